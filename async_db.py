@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent data loading on top of the database module
+@author: 33952
+"""
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+import database as db
+
+# 并发读取上限与单个请求超时（秒）
+ASYNC_MAX_CONCURRENCY = 4
+ASYNC_TIMEOUT = 15.0
+# 进程级线程池：asyncio.run 退出时只等待循环自带的默认线程池，超时放弃的请求留在这里继续执行，
+# 不会拖住页面；线程数留出余量，给仍在运行的放弃请求占用
+ASYNC_MAX_WORKERS = 16
+EXECUTOR = ThreadPoolExecutor(max_workers=ASYNC_MAX_WORKERS, thread_name_prefix="async_db")
+
+
+class AsyncDatabase:
+    """Async variant of the database module.
+
+    Any database function is available as a coroutine (``await adb.get_groups()``);
+    it runs on the shared ``EXECUTOR`` pool, at most ``max_concurrency`` at a
+    time, and is abandoned after ``timeout`` seconds. An abandoned call keeps
+    running in its pool thread until the underlying request returns, but
+    ``load_bundle`` returns without waiting for it.
+    """
+
+    def __init__(self, max_concurrency=ASYNC_MAX_CONCURRENCY, timeout=ASYNC_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self._semaphore = None
+        self._loop = None
+
+    def _limit(self):
+        # Semaphore 绑定在事件循环上，每个新的循环（每次 load_bundle）各用一个
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._semaphore = loop, asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    async def call(self, fn, *args, timeout=None, **kwargs):
+        # 把当前会话的脚本上下文带进工作线程，st.error 等提示仍显示在页面上
+        ctx = get_script_run_ctx(suppress_warning=True)
+
+        def run():
+            if ctx is not None:
+                add_script_run_ctx(ctx=ctx)
+            return fn(*args, **kwargs)
+
+        async with self._limit():
+            loop = asyncio.get_running_loop()
+            return await asyncio.wait_for(loop.run_in_executor(EXECUTOR, run), timeout or self.timeout)
+
+    def __getattr__(self, name):
+        fn = getattr(db, name)
+        if not callable(fn):
+            raise AttributeError(name)
+        return functools.partial(self.call, fn)
+
+    async def gather(self, requests):
+        """Run ``requests`` ({name: fn or (fn, *args)}) concurrently; returns {name: result or exception}."""
+        names = list(requests)
+        calls = [request if isinstance(request, tuple) else (request,) for request in requests.values()]
+        results = await asyncio.gather(*(self.call(*call) for call in calls), return_exceptions=True)
+        return dict(zip(names, results))
+
+
+adb = AsyncDatabase()
+
+
+def load_bundle(requests, defaults=None):
+    """Sync facade for Streamlit pages: run independent reads concurrently and return {name: result}.
+
+    A request that fails or times out is reported with ``st.warning`` and
+    replaced by its entry in ``defaults`` (``None`` when absent), so one slow
+    query degrades its own section instead of the whole page.
+    """
+    defaults = defaults or {}
+    results = asyncio.run(adb.gather(requests))
+    for name, result in results.items():
+        if isinstance(result, BaseException):
+            reason = "超时" if isinstance(result, asyncio.TimeoutError) else result
+            st.warning(f"读取 {name} 失败: {reason}")
+            results[name] = defaults.get(name)
+    return results
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark suite on a synthetic cohort, run against a local SQLite backend
+@author: 33952
+
+Usage:
+    python benchmark.py --users 2000 --groups 20 --density 0.3
+    python benchmark.py --save-baseline          # 记录当前结果为基线
+    python benchmark.py --tolerance 0.25         # p50 比基线慢 25% 以上即视为回退
+    python benchmark.py --startup                # 冷启动：导入 main 到登录页渲染完成的耗时
+"""
+
+import argparse
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+
+# 基准只在本地运行：使用内存 SQLite 后端，缺少密钥时生成临时密钥
+os.environ.setdefault("SCORING_BACKEND", "sqlite")
+os.environ.setdefault("SCORING_SQLITE_PATH", ":memory:")
+if not os.environ.get("SCORING_ENCRYPTION_KEY"):
+    from cryptography.fernet import Fernet
+    os.environ["SCORING_ENCRYPTION_KEY"] = Fernet.generate_key().decode()
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+import database as db
+from storage import SQLiteBackend
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+HEAVY_MODULES = ("pandas", "numpy", "plotly", "openpyxl", "xlsxwriter", "pyarrow", "supabase", "cryptography")
+# 在全新解释器中执行，测量部署后首个请求的冷启动
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+main.login_page()
+done = time.perf_counter()
+print(json.dumps({"import": imported - start, "login": done - start,
+                  "loaded": [m for m in %r if m in sys.modules]}))
+""" % (HEAVY_MODULES,)
+
+
+def generate_cohort(n_users, n_groups, density, spread_days, n_teachers=None, seed=0):
+    """Synthetic users and scores following the app's rating rules.
+
+    Students rate students outside their own group (1-10), teachers rate every
+    student (1-15); ``density`` is the fraction of those eligible pairs scored.
+    Timestamps are spread uniformly over the last ``spread_days`` days.
+    """
+    rng = np.random.default_rng(seed)
+    n_teachers = n_teachers if n_teachers is not None else max(1, n_users // 30)
+    password = db.get_cipher().encrypt(b"1234").decode()
+    groups = [f"group{g}" for g in range(n_groups)]
+    student_groups = np.arange(n_users) % n_groups
+    users = [
+        {"username": f"student{i}", "realname": f"学生{i}", "roles": "Student",
+         "group_name": groups[student_groups[i]], "password": password, "modified": 0}
+        for i in range(n_users)
+    ] + [
+        {"username": f"teacher{i}", "realname": f"老师{i}", "roles": "Teacher",
+         "group_name": "Undefined", "password": password, "modified": 0}
+        for i in range(n_teachers)
+    ]
+
+    per_student = max(0, int(round(density * (n_users - n_users / n_groups))))
+    per_teacher = int(round(density * n_users))
+    raters, targets, scores = [], [], []
+    if per_student:
+        draws = rng.integers(0, n_users, size=(n_users, per_student * 2))
+        for rater in range(n_users):
+            eligible = draws[rater][student_groups[draws[rater]] != student_groups[rater]]
+            chosen = np.unique(eligible)[:per_student]
+            raters.append(np.full(len(chosen), rater))
+            targets.append(chosen)
+            scores.append(rng.integers(1, 11, len(chosen)))
+    for teacher in range(n_teachers):
+        chosen = rng.choice(n_users, per_teacher, replace=False)
+        raters.append(np.full(len(chosen), n_users + teacher))
+        targets.append(chosen)
+        scores.append(rng.integers(1, 16, len(chosen)))
+    raters = np.concatenate(raters) if raters else np.array([], dtype=int)
+    targets = np.concatenate(targets) if targets else np.array([], dtype=int)
+    scores = np.concatenate(scores) if scores else np.array([], dtype=int)
+
+    now = datetime.now(timezone.utc)
+    offsets = rng.uniform(0, spread_days * 86400, len(raters))
+    names = [u["username"] for u in users]
+    score_rows = [
+        {"round_id": db.DEFAULT_ROUND, "rater": names[r], "target": names[t], "score": int(s),
+         "timestamp": (now - timedelta(seconds=float(o))).strftime("%Y-%m-%dT%H:%M:%S.%fZ")}
+        for r, t, s, o in zip(raters, targets, scores, offsets)
+    ]
+    return groups, users, score_rows
+
+
+def seed_backend(groups, users, scores, history=0):
+    """Load a cohort into a fresh in-memory SQLite backend.
+
+    ``history`` finished rounds holding a copy of the same scores are added
+    before the current one, to check that reads of the current round do not
+    slow down as past rounds accumulate.
+    """
+    backend = SQLiteBackend(":memory:")
+    for group in groups:
+        backend.insert_group(group)
+    backend.insert_users(users)
+    for h in range(history):
+        round_id = f"past{h}"
+        started = datetime(2000, 1, 1, tzinfo=timezone.utc) + timedelta(days=h)
+        backend.insert_round({"round_id": round_id, "name": f"往届 {h}",
+                              "started_at": started.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                              "finished_at": (started + timedelta(hours=1)).strftime("%Y-%m-%dT%H:%M:%SZ")})
+        past = [{**row, "round_id": round_id} for row in scores]
+        for start in range(0, len(past), 10000):
+            backend.upsert_scores(past[start:start + 10000])
+    for start in range(0, len(scores), 10000):
+        backend.upsert_scores(scores[start:start + 10000])
+    db.set_backend(backend)
+    return backend
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) if values else 0.0
+
+
+def run_case(name, fn, repeat, rows=0, setup=None):
+    """Time ``fn`` ``repeat`` times, then once more under tracemalloc for peak memory."""
+    timings = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    if setup:
+        setup()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    mean = sum(timings) / len(timings)
+    return {
+        "name": name, "repeat": repeat, "rows": rows,
+        "mean_ms": mean * 1000, "p50_ms": percentile(timings, 50) * 1000,
+        "p95_ms": percentile(timings, 95) * 1000, "p99_ms": percentile(timings, 99) * 1000,
+        "ops_per_s": 1 / mean if mean else 0.0, "rows_per_s": rows / mean if mean else 0.0,
+        "peak_mib": peak / 2 ** 20,
+    }
+
+
+def parse_importtime(stderr, top=10):
+    """Modules imported directly by main, by cumulative import time (ms), from ``-X importtime`` output."""
+    modules, children = [], []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # 每层缩进两个空格：" main" 为顶层，"   database" 为其直接导入的模块；
+        # 输出按后序排列，子模块先于父模块出现，因此收集到下一个顶层行为止
+        if name.startswith("   ") and not name.startswith("    "):
+            children.append((name.strip(), int(cumulative) / 1000))
+        elif not name.startswith("  "):
+            if name.strip() == "main":
+                modules = children
+            children = []
+    return sorted(modules, key=lambda m: m[1], reverse=True)[:top]
+
+def startup_report(repeat):
+    """Time ``import main`` and the login page in fresh interpreters; returns (cases, modules, loaded)."""
+    here = os.path.dirname(os.path.abspath(__file__))
+    imports, logins = [], []
+    for _ in range(repeat):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", STARTUP_SCRIPT],
+                              cwd=here, capture_output=True, text=True, check=True)
+        timing = json.loads(proc.stdout.strip().splitlines()[-1])
+        imports.append(timing["import"])
+        logins.append(timing["login"])
+    cases = [
+        {"name": name, "repeat": repeat, "rows": 0, "mean_ms": sum(t) / len(t) * 1000,
+         "p50_ms": percentile(t, 50) * 1000, "p95_ms": percentile(t, 95) * 1000, "p99_ms": percentile(t, 99) * 1000,
+         "ops_per_s": len(t) / sum(t), "rows_per_s": 0.0, "peak_mib": 0.0}
+        for name, t in (("import_main", imports), ("time_to_login_page", logins))
+    ]
+    return cases, parse_importtime(proc.stderr), timing["loaded"]
+
+def run_suite(args):
+    # 延迟导入：scoring 在导入时注册写入监听器，需在后端就绪后加载
+    import scoring
+    import visualization
+    import results_store
+    import rollups
+    import rating_index
+
+    groups, users, scores = generate_cohort(args.users, args.groups, args.density, args.spread_days, seed=args.seed)
+    seed_backend(groups, users, scores, args.history)
+    cold = lambda: db.cache.invalidate("users", "scores", "groups")
+    all_scores, users_df = db.get_all_scores(), pd.DataFrame(db.get_user_directory())
+    scores_df = pd.DataFrame(all_scores)
+    final = scoring.calculate_scores(all_scores, users_df)
+    rater = next(u["username"] for u in users if u["roles"] == "Teacher")
+    submission = {u["username"]: 8 for u in users if u["roles"] == "Student"}
+    submission_target = next(iter(submission))
+
+    def visualize_data_path():
+        # 与 main.visualize_page 相同的数据路径
+        df = scoring.calculate_scores()
+        visualization.plot_group_comparison(df)
+        visualization.plot_individual_comparison(df)
+        visualization.plot_scoring_trends(trend=rollups.get_trend("day"))
+        target = df['username'].iloc[0]
+        visualization.plot_scoring_details(target)
+
+    cases = [
+        ("get_all_users", db.get_all_users, len(users), cold),
+        ("get_all_scores", db.get_all_scores, len(scores), cold),
+        ("get_rating_aggregates", db.get_rating_aggregates, len(scores), cold),
+        ("get_daily_means", db.get_daily_means, len(scores), cold),
+        ("rollup_rebuild", rollups.rollup.rebuild, len(scores), None),
+        ("rollup_trend_day", lambda: rollups.get_trend("day"), len(scores), None),
+        ("rollup_trend_week", lambda: rollups.get_trend("week"), len(scores), None),
+        ("rating_index_rebuild", rating_index.rating_index.rebuild, len(scores), None),
+        ("rating_index_target", lambda: rating_index.get_target_ratings(submission_target), len(users), None),
+        ("rating_index_missing", lambda: rating_index.rating_index.missing_pairs(rater), len(users), None),
+        ("rating_index_coverage", rating_index.rating_index.group_coverage, len(users), None),
+        ("calculate_scores", lambda: scoring.calculate_scores(all_scores, users_df), len(scores), None),
+        ("calculate_scores_incremental", scoring.calculate_scores, len(users), None),
+        ("save_scores", lambda: db.save_scores(rater, submission), len(submission), None),
+        ("plot_group_comparison", lambda: visualization.plot_group_comparison(final), len(final), None),
+        ("plot_individual_comparison", lambda: visualization.plot_individual_comparison(final), len(final), None),
+        ("plot_scoring_trends", lambda: visualization.plot_scoring_trends(scores_df), len(scores), None),
+        ("plot_scoring_details", lambda: visualization.plot_scoring_details(rater, scores_df), len(scores), None),
+        ("visualize_page_data_path", visualize_data_path, len(scores), cold),
+        ("results_snapshot_build", results_store.get_results, len(scores), results_store.results_store.clear),
+        ("results_snapshot_hit", results_store.get_results, len(scores), None),
+    ]
+    selected = set(args.only or [name for name, *_ in cases])
+    return [run_case(name, fn, args.repeat, rows, setup) for name, fn, rows, setup in cases if name in selected]
+
+
+def compare(results, baseline, tolerance):
+    """Return (name, baseline p50, current p50) for every case slower than baseline by more than ``tolerance``."""
+    previous = {case["name"]: case for case in baseline.get("results", [])}
+    regressions = []
+    for case in results:
+        old = previous.get(case["name"])
+        if old and case["p50_ms"] > old["p50_ms"] * (1 + tolerance):
+            regressions.append((case["name"], old["p50_ms"], case["p50_ms"]))
+    return regressions
+
+
+def print_report(results):
+    header = f"{'case':<30}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'ops/s':>10}{'rows/s':>14}{'peak MiB':>10}"
+    print(header)
+    print("-" * len(header))
+    for case in results:
+        print(f"{case['name']:<30}{case['p50_ms']:>10.2f}{case['p95_ms']:>10.2f}{case['p99_ms']:>10.2f}"
+              f"{case['ops_per_s']:>10.1f}{case['rows_per_s']:>14.0f}{case['peak_mib']:>10.2f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="评分系统基准测试")
+    parser.add_argument("--users", type=int, default=500, help="学生人数 N")
+    parser.add_argument("--groups", type=int, default=10, help="组数 M")
+    parser.add_argument("--density", type=float, default=0.5, help="可评分 (rater, target) 对中实际评分的比例")
+    parser.add_argument("--spread-days", type=float, default=30, help="评分时间分布的天数")
+    parser.add_argument("--history", type=int, default=0, help="当前轮次之前的往届轮次数（各含一份同样的评分）")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", nargs="*", help="只运行指定的用例")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    parser.add_argument("--startup", action="store_true", help="只测冷启动（导入与登录页）")
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        results, modules, loaded = startup_report(args.repeat)
+        print_report(results)
+        print("\n导入耗时最多的模块（ms）:")
+        for name, ms in modules:
+            print(f"  {name:<28}{ms:>10.1f}")
+        print(f"登录页已加载的重型依赖: {', '.join(loaded) or '无'}")
+        args.baseline = args.baseline.replace(".json", "_startup.json")
+    else:
+        results = run_suite(args)
+        print_report(results)
+    config = {k: getattr(args, k) for k in ("users", "groups", "density", "spread_days", "seed", "history")}
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump({"config": config, "results": results}, f, indent=2, ensure_ascii=False)
+        print(f"基线已保存到 {args.baseline}")
+        return 0
+    if not os.path.exists(args.baseline):
+        print(f"未找到基线 {args.baseline}，跳过对比")
+        return 0
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("config") != config:
+        print(f"基线参数 {baseline.get('config')} 与本次 {config} 不一致，跳过对比")
+        return 0
+    regressions = compare(results, baseline, args.tolerance)
+    for name, old, new in regressions:
+        print(f"性能回退: {name} p50 {old:.2f} ms -> {new:.2f} ms")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
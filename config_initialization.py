@@ -2,49 +2,175 @@
 """
 Initial configuration for users and groups
 @author: 33952
+
+Usage:
+    python config_initialization.py roster.csv --dry-run
+    python config_initialization.py roster.json
 """
 
-from database import create_user, create_group, get_groups, get_all_users
+import argparse
+import csv
+import json
+import sys
+import time
+
+import database as db
+from database import create_group, create_users_bulk, get_groups, iter_users
 import streamlit as st
 
-def initialize_groups():
-    existing_groups = get_groups()
-    groups = ['第一组', '第二组', '第三组']
-    for group in groups:
-        if group not in existing_groups:
-            if create_group(group):
-                st.write(f"成功创建组别: {group}")
+DEFAULT_PASSWORD = "1234"
+VALID_ROLES = ("Student", "Teacher", "Admin")
+ROSTER_COLUMNS = ["username", "realname", "roles", "group", "password"]
+
+# 内置名单：3 个组、15 名学生、1 名管理员、1 名教师
+DEFAULT_ROSTER = {
+    "groups": ['第一组', '第二组', '第三组'],
+    "users": [
+        {"username": f"student{i}", "realname": f"学生{i}", "roles": "Student",
+         "group": ['第一组', '第二组', '第三组'][(i - 1) // 5]}
+        for i in range(1, 16)
+    ] + [
+        {"username": "admin1", "realname": "管理员1", "roles": "Admin", "group": "Undefined"},
+        {"username": "teacher1", "realname": "老师1", "roles": "Teacher", "group": "Undefined"},
+    ],
+}
+
+
+def load_roster(path):
+    """Read a roster file: CSV with ROSTER_COLUMNS, or JSON {"groups": [...], "users": [...]}."""
+    if path.endswith(".json"):
+        with open(path, encoding="utf-8") as f:
+            roster = json.load(f)
+        return {"groups": list(roster.get("groups", [])), "users": list(roster.get("users", []))}
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        return {"groups": [], "users": list(csv.DictReader(f))}
+
+
+def _clean_user(row):
+    # 返回 (用户, 错误原因)；roles 可写成列表或逗号分隔文本，密码缺省为 DEFAULT_PASSWORD
+    username = str(row.get("username") or "").strip()
+    if not username:
+        return None, "缺少 username"
+    roles = row.get("roles") or ""
+    roles = [r.strip() for r in (roles.split(",") if isinstance(roles, str) else roles) if r.strip()]
+    if not roles or any(r not in VALID_ROLES for r in roles):
+        return None, f"{username}: 身份须为 {'/'.join(VALID_ROLES)} 之一"
+    group = str(row.get("group") or "").strip() or "Undefined"
+    if "Student" in roles and group == "Undefined":
+        return None, f"{username}: 学生必须指定组别"
+    return {"username": username, "realname": str(row.get("realname") or "").strip() or username,
+            "roles": ",".join(roles), "group": group,
+            "password": str(row.get("password") or "").strip() or DEFAULT_PASSWORD}, None
+
+
+def plan_seed(roster):
+    """Diff ``roster`` against the database: groups and users to create, plus rows skipped and why.
+
+    Existing usernames come from a single username-only paginated read, and
+    existing groups from the cached group list, so the cost does not depend
+    on how many roster rows are already present.
+    """
+    existing_groups = set(get_groups())
+    existing_users = {user["username"] for page in iter_users(columns=["username"]) for user in page}
+    plan = {"groups": [], "users": [], "existing_groups": 0, "existing_users": 0, "duplicates": 0, "errors": []}
+    seen = set()
+    # 名单中显式列出的组别，加上名单中学生所在的组别
+    wanted = list(roster["groups"])
+    for row in roster["users"]:
+        user, error = _clean_user(row)
+        if error:
+            plan["errors"].append(error)
+            continue
+        if "Student" in user["roles"].split(","):
+            wanted.append(user["group"])
+        if user["username"] in seen:
+            plan["duplicates"] += 1
+        elif user["username"] in existing_users:
+            seen.add(user["username"])
+            plan["existing_users"] += 1
+        else:
+            seen.add(user["username"])
+            plan["users"].append(user)
+    for group in dict.fromkeys(str(g).strip() for g in wanted if str(g).strip() not in ("", "Undefined")):
+        if group in existing_groups:
+            plan["existing_groups"] += 1
+        else:
+            plan["groups"].append(group)
+    return plan
+
+
+def seed(roster, dry_run=False, chunk_size=db.BULK_CHUNK_SIZE):
+    """Create the groups and users of ``roster`` that do not exist yet; running it again is a no-op.
+
+    Passwords are encrypted in one batch and users inserted in ``chunk_size``
+    batches by ``create_users_bulk``. With ``dry_run`` only the diff is
+    computed. Returns a summary with counts, errors and per-phase timings (ms).
+    """
+    timings = {}
+    started = time.perf_counter()
+    plan = plan_seed(roster)
+    timings["diff_ms"] = (time.perf_counter() - started) * 1000
+    summary = {
+        "dry_run": dry_run, "new_groups": len(plan["groups"]), "existing_groups": plan["existing_groups"],
+        "new_users": len(plan["users"]), "existing_users": plan["existing_users"],
+        "duplicates": plan["duplicates"], "invalid": len(plan["errors"]), "errors": list(plan["errors"]),
+        "groups_created": 0, "users_created": 0, "users_failed": 0, "timings": timings,
+    }
+    if dry_run:
+        return summary
+
+    phase = time.perf_counter()
+    summary["groups_created"] = sum(bool(create_group(group)) for group in plan["groups"])
+    timings["groups_ms"] = (time.perf_counter() - phase) * 1000
+
+    phase = time.perf_counter()
+    if plan["users"]:
+        for result in create_users_bulk(plan["users"], chunk_size=chunk_size):
+            if result["ok"]:
+                summary["users_created"] += result["rows"]
             else:
-                st.warning(f"组别 {group} 创建失败或已存在")
+                summary["users_failed"] += result["rows"]
+                summary["errors"].append(f"{result['rows']} 个用户写入失败: {result['error']}")
+    timings["users_ms"] = (time.perf_counter() - phase) * 1000
+    timings["total_ms"] = (time.perf_counter() - started) * 1000
+    return summary
+
+
+def initialize_groups():
+    return seed({"groups": DEFAULT_ROSTER["groups"], "users": []})
+
 
 def initialize_users():
-    existing_users = [u['username'] for u in get_all_users()]
-    if not existing_users:
-        st.warning("无法获取现有用户列表，可能数据库连接失败或表为空")
-    
-    for i in range(1, 16):
-        username = f"student{i}"
-        if username not in existing_users:
-            group = ['第一组', '第二组', '第三组'][(i-1)//5]
-            if create_user(username, f"学生{i}", "Student", group, "1234"):
-                st.write(f"成功创建用户: {username}")
-        else:
-            st.write(f"用户 {username} 已存在，跳过创建")
-    
-    if "admin1" not in existing_users:
-        if create_user("admin1", "管理员1", "Admin", "Undefined", "1234"):
-            st.write("成功创建管理员: admin1")
-    else:
-        st.write("管理员 admin1 已存在，跳过创建")
-    
-    if "teacher1" not in existing_users:
-        if create_user("teacher1", "老师1", "Teacher", "Undefined", "1234"):
-            st.write("成功创建教师: teacher1")
-    else:
-        st.write("教师 teacher1 已存在，跳过创建")
-
-def initialize_all():
+    return seed({"groups": [], "users": DEFAULT_ROSTER["users"]})
+
+
+def initialize_all(roster=None, dry_run=False):
     st.write("开始初始化数据...")
-    initialize_groups()
-    initialize_users()
-    st.write("初始化完成！")
+    summary = seed(DEFAULT_ROSTER if roster is None else roster, dry_run)
+    st.write(f"组别：新建 {summary['groups_created']}/{summary['new_groups']}，已存在 {summary['existing_groups']}")
+    st.write(f"用户：新建 {summary['users_created']}/{summary['new_users']}，已存在 {summary['existing_users']}，"
+             f"重复 {summary['duplicates']}，无效 {summary['invalid']}")
+    for error in summary["errors"]:
+        st.warning(error)
+    st.write({phase: f"{ms:.0f} ms" for phase, ms in summary["timings"].items()})
+    st.write("初始化完成！" if not dry_run else "预演完成，未写入任何数据")
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="按名单文件批量初始化组别与用户（重复执行不会重复创建）")
+    parser.add_argument("roster", nargs="?", help="名单文件（.csv 或 .json），缺省使用内置名单")
+    parser.add_argument("--dry-run", action="store_true", help="只计算需要新建的组别与用户，不写入")
+    parser.add_argument("--chunk-size", type=int, default=db.BULK_CHUNK_SIZE)
+    args = parser.parse_args(argv)
+
+    roster = load_roster(args.roster) if args.roster else DEFAULT_ROSTER
+    summary = seed(roster, args.dry_run, args.chunk_size)
+    print(json.dumps({k: v for k, v in summary.items() if k != "errors"}, ensure_ascii=False, indent=2))
+    for error in summary["errors"]:
+        print(f"  {error}", file=sys.stderr)
+    return 1 if summary["users_failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
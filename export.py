@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming data export to Excel, CSV and Parquet
+@author: 33952
+
+Usage:
+    python export.py -o data_export.xlsx
+    python export.py -f csv -t scores --scores-columns rater target score -o scores.csv
+    python export.py -f parquet -o data_export.zip    # 多张表打包为 zip
+"""
+
+import argparse
+import csv
+import io
+import sys
+import zipfile
+
+import database as db
+
+EXPORT_FORMATS = ("xlsx", "csv", "parquet")
+TABLE_COLUMNS = {"users": list(db.USER_COLUMNS), "scores": list(db.SCORE_COLUMNS)}
+# 工作表名与导入管道（importer）保持一致，导出的文件可直接重新导入
+SHEET_NAMES = {"users": "Users", "scores": "Scores"}
+MIME_TYPES = {
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+    "csv": "text/csv",
+    "parquet": "application/vnd.apache.parquet",
+    "zip": "application/zip",
+}
+
+
+def iter_rows(table, columns, page_size=db.PAGE_SIZE):
+    """Yield pages of row tuples in ``columns`` order, straight from the paginated readers."""
+    if table == "users":
+        pages = db.iter_users(page_size, columns)
+    else:
+        pages = db.iter_scores(page_size, columns)
+    for page in pages:
+        # 用户行为 LazyUser，按列取值时才解密密码
+        yield [tuple(",".join(v) if isinstance(v, list) else v for v in (row.get(c) for c in columns)) for row in page]
+
+
+def write_xlsx(out, tables, page_size=db.PAGE_SIZE):
+    import xlsxwriter
+    # constant_memory 模式下每行写出后即刷到临时文件，内存占用与行数无关
+    workbook = xlsxwriter.Workbook(out, {"constant_memory": True})
+    try:
+        for table, columns in tables.items():
+            sheet = workbook.add_worksheet(SHEET_NAMES[table])
+            sheet.write_row(0, 0, columns)
+            row_index = 1
+            for page in iter_rows(table, columns, page_size):
+                for row in page:
+                    sheet.write_row(row_index, 0, row)
+                    row_index += 1
+    finally:
+        workbook.close()
+
+
+def write_csv(out, table, columns, page_size=db.PAGE_SIZE):
+    text = io.TextIOWrapper(out, encoding="utf-8-sig", newline="")
+    try:
+        writer = csv.writer(text)
+        writer.writerow(columns)
+        for page in iter_rows(table, columns, page_size):
+            writer.writerows(page)
+    finally:
+        text.flush()
+        text.detach()
+
+
+def _parquet_schema(columns):
+    import pyarrow as pa
+    types = {"score": pa.int64()}
+    return pa.schema([(c, types.get(c, pa.string())) for c in columns])
+
+
+def write_parquet(out, table, columns, page_size=db.PAGE_SIZE):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError("导出 Parquet 需要安装 pyarrow") from e
+    schema = _parquet_schema(columns)
+    # 每页写为一个 row group，不在内存中拼接整表
+    with pq.ParquetWriter(out, schema) as writer:
+        for page in iter_rows(table, columns, page_size):
+            writer.write_table(pa.Table.from_arrays([pa.array(col, type=schema.field(c).type)
+                                                     for c, col in zip(columns, zip(*page))], schema=schema))
+
+
+def export(out, fmt, tables, page_size=db.PAGE_SIZE):
+    """Write ``tables`` ({table: columns}) to the binary file object ``out``; returns the MIME type.
+
+    xlsx puts each table on its own sheet; csv and parquet write a single table
+    directly, or a zip with one member per table when several are selected.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}")
+    if fmt == "xlsx":
+        write_xlsx(out, tables, page_size)
+        return MIME_TYPES["xlsx"]
+    write = write_csv if fmt == "csv" else write_parquet
+    if len(tables) == 1:
+        (table, columns), = tables.items()
+        write(out, table, columns, page_size)
+        return MIME_TYPES[fmt]
+    with zipfile.ZipFile(out, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for table, columns in tables.items():
+            with archive.open(f"{table}.{fmt}", "w", force_zip64=True) as member:
+                write(member, table, columns, page_size)
+    return MIME_TYPES["zip"]
+
+
+def file_name(fmt, tables):
+    if fmt == "xlsx":
+        return "data_export.xlsx"
+    if len(tables) == 1:
+        return f"{next(iter(tables))}_export.{fmt}"
+    return f"data_export_{fmt}.zip"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="导出用户与评分数据")
+    parser.add_argument("-f", "--format", choices=EXPORT_FORMATS, default="xlsx")
+    parser.add_argument("-t", "--tables", nargs="+", choices=list(TABLE_COLUMNS), default=list(TABLE_COLUMNS))
+    parser.add_argument("--users-columns", nargs="+", choices=TABLE_COLUMNS["users"])
+    parser.add_argument("--scores-columns", nargs="+", choices=TABLE_COLUMNS["scores"])
+    parser.add_argument("--page-size", type=int, default=db.PAGE_SIZE)
+    parser.add_argument("-o", "--output")
+    args = parser.parse_args(argv)
+
+    tables = {t: getattr(args, f"{t}_columns") or TABLE_COLUMNS[t] for t in args.tables}
+    output = args.output or file_name(args.format, tables)
+    with open(output, "wb") as out:
+        export(out, args.format, tables, args.page_size)
+    print(f"已导出到 {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
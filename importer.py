@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+"""
+Bulk streaming Excel import for the admin data tab
+@author: 33952
+"""
+
+import pandas as pd
+from openpyxl import load_workbook
+import database as db
+
+IMPORT_CHUNK_SIZE = 2000
+USER_COLUMNS = ['username', 'realname', 'roles', 'group', 'password']
+SCORE_COLUMNS = ['rater', 'target', 'score']
+MAX_SCORE = 15
+
+
+def read_sheet_chunks(worksheet, chunk_size=IMPORT_CHUNK_SIZE):
+    """Yield DataFrames of at most ``chunk_size`` rows, using the first row as header."""
+    rows = worksheet.iter_rows(values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return
+    columns = [str(c).strip() if c is not None else f'_{i}' for i, c in enumerate(header)]
+    batch = []
+    for row in rows:
+        if any(value is not None for value in row):
+            batch.append(row)
+        if len(batch) == chunk_size:
+            yield pd.DataFrame(batch, columns=columns)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, columns=columns)
+
+
+def _text(series):
+    # 数值单元格中的 1234 可能读成 1234.0，转为不带小数的文本；文本单元格原样保留（"0012" 不会变成 "12"）
+    def convert(value):
+        if isinstance(value, float) and value.is_integer():
+            return str(int(value))
+        return str(value).strip()
+    return series.map(convert, na_action='ignore').astype('string')
+
+
+def _new_summary(sheet):
+    return {'sheet': sheet, 'inserted': 0, 'skipped': 0, 'failed': 0, 'errors': []}
+
+
+def _record_failures(summary, mask, reason):
+    count = int(mask.sum())
+    if count:
+        summary['failed'] += count
+        summary['errors'].append(f"{count} 行{reason}")
+
+
+def _record_results(summary, results):
+    for result in results:
+        if result['ok']:
+            summary['inserted'] += result['rows']
+        else:
+            summary['failed'] += result['rows']
+            summary['errors'].append(f"{result['rows']} 行写入失败: {result['error']}")
+
+
+def import_users(chunk, existing, summary):
+    """Validate one Users chunk, skip usernames that already exist and bulk-insert the rest."""
+    users = pd.DataFrame({c: _text(chunk[c]) for c in USER_COLUMNS})
+    users['group'] = users['group'].fillna('Undefined')
+    invalid = users[['username', 'realname', 'roles', 'password']].isna().any(axis=1) | users['username'].eq('')
+    _record_failures(summary, invalid, '缺少必填字段（username/realname/roles/password）')
+    users = users[~invalid]
+    duplicate = users['username'].isin(existing) | users['username'].duplicated()
+    summary['skipped'] += int(duplicate.sum())
+    new_users = users[~duplicate]
+    if not new_users.empty:
+        _record_results(summary, db.create_users_bulk(new_users.to_dict('records')))
+        existing.update(new_users['username'])
+
+
+def import_scores(chunk, known_users, summary):
+    """Validate one Scores chunk against known usernames and the score range, then bulk-upsert it."""
+    scores = pd.DataFrame({'rater': _text(chunk['rater']), 'target': _text(chunk['target']),
+                           'score': pd.to_numeric(chunk['score'], errors='coerce')})
+    missing = scores.isna().any(axis=1)
+    _record_failures(summary, missing, '缺少 rater/target/score 或分数不是数字')
+    scores = scores[~missing]
+    out_of_range = (scores['score'] % 1 != 0) | ~scores['score'].between(1, MAX_SCORE)
+    _record_failures(summary, out_of_range, f'分数不是 1-{MAX_SCORE} 的整数')
+    scores = scores[~out_of_range]
+    unknown = ~scores['rater'].isin(known_users) | ~scores['target'].isin(known_users)
+    _record_failures(summary, unknown, '评分者或被评分者不存在')
+    scores = scores[~unknown]
+    duplicate = scores.duplicated(['rater', 'target'], keep='last')
+    summary['skipped'] += int(duplicate.sum())
+    scores = scores[~duplicate].astype({'score': 'int64'})
+    if not scores.empty:
+        try:
+            _record_results(summary, db.save_scores_bulk(scores.to_dict('records')))
+        except db.RoundClosedError as e:
+            summary['failed'] += len(scores)
+            summary['errors'].append(str(e))
+
+
+def import_workbook(source, progress=None, chunk_size=IMPORT_CHUNK_SIZE):
+    """Stream the Users and Scores sheets of ``source`` into the database.
+
+    ``progress(fraction, text)`` is called after every chunk. Returns one summary
+    per imported sheet with inserted, skipped and failed row counts and errors.
+    """
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        sheets = [name for name in ('Users', 'Scores') if name in workbook.sheetnames]
+        total = sum(max((workbook[name].max_row or 1) - 1, 0) for name in sheets) or 1
+        # 一次投影查询取回现有用户名，用于去重和校验评分双方
+        existing = {user['username'] for page in db.iter_users(columns=['username']) for user in page}
+        done = 0
+        summaries = []
+        for name in sheets:
+            summary = _new_summary(name)
+            columns = USER_COLUMNS if name == 'Users' else SCORE_COLUMNS
+            for chunk in read_sheet_chunks(workbook[name], chunk_size):
+                missing = [c for c in columns if c not in chunk.columns]
+                if missing:
+                    summary['failed'] += len(chunk)
+                    summary['errors'].append(f"缺少列: {', '.join(missing)}")
+                elif name == 'Users':
+                    import_users(chunk, existing, summary)
+                else:
+                    import_scores(chunk, existing, summary)
+                done += len(chunk)
+                if progress:
+                    progress(min(done / total, 1.0), f"{name}: 已处理 {done} 行")
+            summaries.append(summary)
+        return summaries
+    finally:
+        workbook.close()
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""
+Hot-path timing and metrics, rolled up per rerun and per session
+@author: 33952
+"""
+
+import functools
+import inspect
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+
+# 设为 0 可关闭记录（包装函数仍在，只多一次判断）
+METRICS_ENABLED = os.environ.get("SCORING_METRICS", "1") != "0"
+METRICS_MAX_CALLS = 50000
+METRICS_MAX_RERUNS = 2000
+METRICS_MAX_SESSIONS = 1000
+SIZE_SAMPLE_ROWS = 50  # 估算列表字节数时抽样的行数
+
+
+def estimate_size(value):
+    """Return (rows, approximate bytes) for a returned value; lists are sampled, not walked."""
+    if hasattr(value, "memory_usage") and hasattr(value, "shape"):
+        return len(value), int(value.memory_usage(index=False).sum())
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], dict):
+        sample = value[:SIZE_SAMPLE_ROWS]
+        per_row = sum(sys.getsizeof(row) + sum(sys.getsizeof(v) for v in row.values()) for row in sample) / len(sample)
+        return len(value), int(per_row * len(value))
+    if isinstance(value, (list, dict, set)):
+        return len(value), sys.getsizeof(value)
+    return None, None
+
+
+def _session_id():
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return ctx.session_id if ctx is not None else None
+
+
+class MetricsRecorder:
+    """Bounded in-process log of timed calls and reruns, shared by every session."""
+
+    def __init__(self, max_calls=METRICS_MAX_CALLS, max_reruns=METRICS_MAX_RERUNS):
+        self._lock = threading.Lock()
+        self.calls = deque(maxlen=max_calls)
+        self.reruns = deque(maxlen=max_reruns)
+        self._active = {}  # session_id -> 当前 rerun 的累计信息
+
+    def record(self, name, ms, rows=None, nbytes=None, error=None):
+        session = _session_id()
+        with self._lock:
+            active = self._active.get(session)
+            entry = {"time": time.time(), "session": session, "rerun": active["rerun"] if active else None,
+                     "name": name, "ms": ms, "rows": rows, "bytes": nbytes, "error": error}
+            self.calls.append(entry)
+            if active:
+                active["calls"] += 1
+                active["errors"] += error is not None
+                if ms > active["slowest_ms"]:
+                    active["slowest_ms"], active["slowest"] = ms, name
+
+    def begin_rerun(self, page=None):
+        session = _session_id()
+        with self._lock:
+            previous = self._active.pop(session, None)
+            while len(self._active) >= METRICS_MAX_SESSIONS:
+                # 字典按插入顺序，最早开始 rerun 的会话排在最前
+                self._active.pop(next(iter(self._active)))
+            self._active[session] = {"session": session, "rerun": (previous["rerun"] + 1) if previous else 1,
+                                     "page": page, "start": time.time(), "started": time.perf_counter(),
+                                     "calls": 0, "errors": 0, "slowest": None, "slowest_ms": 0.0}
+
+    def end_rerun(self):
+        session = _session_id()
+        with self._lock:
+            active = self._active.get(session)
+            if not active or "started" not in active:
+                return
+            started = active.pop("started")
+            self.reruns.append({**active, "ms": (time.perf_counter() - started) * 1000})
+
+    def clear(self):
+        with self._lock:
+            self.calls.clear()
+            self.reruns.clear()
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.calls), list(self.reruns)
+
+    def call_summary(self):
+        """Per-call count, errors, latency percentiles (ms), mean rows and total bytes."""
+        import pandas as pd
+        calls, _ = self.snapshot()
+        if not calls:
+            return pd.DataFrame(columns=["name", "calls", "errors", "p50_ms", "p95_ms", "p99_ms", "max_ms",
+                                         "mean_rows", "total_mib"])
+        frame = pd.DataFrame(calls)
+        grouped = frame.groupby("name")
+        summary = pd.DataFrame({
+            "calls": grouped.size(),
+            "errors": grouped["error"].count(),
+            "p50_ms": grouped["ms"].quantile(0.5),
+            "p95_ms": grouped["ms"].quantile(0.95),
+            "p99_ms": grouped["ms"].quantile(0.99),
+            "max_ms": grouped["ms"].max(),
+            "mean_rows": grouped["rows"].mean(),
+            "total_mib": grouped["bytes"].sum() / 2 ** 20,
+        })
+        return summary.sort_values("p95_ms", ascending=False).reset_index()
+
+    def slowest_reruns(self, n=20):
+        import pandas as pd
+        _, reruns = self.snapshot()
+        columns = ["session", "rerun", "page", "ms", "calls", "errors", "slowest", "slowest_ms"]
+        return pd.DataFrame(sorted(reruns, key=lambda r: r["ms"], reverse=True)[:n], columns=columns)
+
+    def session_summary(self):
+        import pandas as pd
+        _, reruns = self.snapshot()
+        columns = ["session", "reruns", "total_ms", "p50_ms", "max_ms", "calls", "errors"]
+        if not reruns:
+            return pd.DataFrame(columns=columns)
+        grouped = pd.DataFrame(reruns).groupby("session", dropna=False)
+        return pd.DataFrame({
+            "reruns": grouped.size(), "total_ms": grouped["ms"].sum(), "p50_ms": grouped["ms"].median(),
+            "max_ms": grouped["ms"].max(), "calls": grouped["calls"].sum(), "errors": grouped["errors"].sum(),
+        }).sort_values("total_ms", ascending=False).reset_index()[columns]
+
+    def to_jsonl(self):
+        calls, reruns = self.snapshot()
+        lines = [json.dumps({"type": "call", **c}, ensure_ascii=False, default=str) for c in calls]
+        lines += [json.dumps({"type": "rerun", **r}, ensure_ascii=False, default=str) for r in reruns]
+        return "\n".join(lines) + "\n" if lines else ""
+
+
+recorder = MetricsRecorder()
+
+
+def _timed_pages(name, pages, started):
+    # 分页生成器：从创建到迭代结束（或提前关闭）计为一次调用
+    rows = nbytes = 0
+    error = None
+    try:
+        for page in pages:
+            page_rows, page_bytes = estimate_size(page)
+            rows += page_rows or 0
+            nbytes += page_bytes or 0
+            yield page
+    except Exception as e:
+        error = type(e).__name__
+        raise
+    finally:
+        recorder.record(name, (time.perf_counter() - started) * 1000, rows, nbytes, error)
+
+
+def instrument(fn, name=None):
+    """Wrap ``fn`` so every call records latency, rows, bytes and errors under ``name``.
+
+    A call that returns a generator (the paginated readers) is timed until the
+    generator is exhausted or closed, with rows and bytes summed over its pages.
+    """
+    if hasattr(fn, "_metrics_name"):
+        return fn
+    name = name or fn.__name__
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        if not METRICS_ENABLED:
+            return fn(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            recorder.record(name, (time.perf_counter() - started) * 1000, error=type(e).__name__)
+            raise
+        if inspect.isgenerator(result):
+            return _timed_pages(name, result, started)
+        rows, nbytes = estimate_size(result)
+        recorder.record(name, (time.perf_counter() - started) * 1000, rows, nbytes)
+        return result
+
+    wrapper._metrics_name = name
+    return wrapper
+
+
+def instrument_module(namespace, names):
+    """Replace each function in ``names`` inside a module namespace (``globals()``) with its timed wrapper."""
+    for name in names:
+        namespace[name] = instrument(namespace[name])
+
+
+class InstrumentedBackend:
+    """Storage backend proxy that times every public method as ``backend.<method>``."""
+
+    UNTIMED = {"resilience_stats"}
+
+    def __init__(self, backend):
+        self._backend = backend
+
+    def __getattr__(self, name):
+        attr = getattr(self._backend, name)
+        if not callable(attr) or name.startswith("_") or name in self.UNTIMED:
+            return attr
+        return instrument(attr, f"backend.{name}")
@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory rating index: per-target ratings, per-rater progress and group coverage
+@author: 33952
+"""
+
+import threading
+from collections import Counter
+
+import database as db
+from database import subscribe
+from metrics import instrument
+
+TEACHER_BUCKET = "教师"  # 教师不属于任何学生组，覆盖率单独统计
+
+
+def _kind(roles):
+    # 与评分页面一致：含 Student 按学生规则评分，否则含 Teacher 按教师规则评分
+    roles = roles.split(",") if isinstance(roles, str) else list(roles or [])
+    if "Student" in roles:
+        return "student"
+    if "Teacher" in roles:
+        return "teacher"
+    return None
+
+
+class RatingIndex:
+    """target -> {rater: score} and rater -> {target: score}, plus completion counters and unrated targets.
+
+    A rater's eligible targets follow the scoring page: students rate every
+    student outside their own group, teachers rate every student. ``apply``
+    folds in each saved chunk, so queries cost time proportional to their
+    answer instead of a scan of the scores table. Only the current round is
+    indexed. Rows written by another process are picked up when the row counts
+    or the round of the data version disagree with the index, which triggers a
+    rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+        self.round_id = None
+        self._reset()
+
+    def _reset(self):
+        self._by_target = {}
+        self._by_rater = {}
+        self._users = {}        # username -> (kind, group, realname)
+        self._students = {}     # group -> {username}
+        self._student_total = 0
+        self._done = Counter()  # rater -> 已评的合规对象数
+        self._coverage = {}     # group/教师 -> [done, expected]
+        self._incomplete = set()
+        self._missing = {}      # rater -> 尚未评分的合规对象
+        self._ratings = 0
+
+    def _bucket(self, rater):
+        kind, group, _ = self._users[rater]
+        return TEACHER_BUCKET if kind == "teacher" else group
+
+    def _expected(self, rater):
+        kind, group, _ = self._users.get(rater, (None, None, None))
+        if kind == "student":
+            return self._student_total - len(self._students.get(group, ()))
+        return self._student_total if kind == "teacher" else 0
+
+    def _eligible(self, rater, target):
+        rater_kind, rater_group, _ = self._users.get(rater, (None, None, None))
+        target_kind, target_group, _ = self._users.get(target, (None, None, None))
+        if target_kind != "student" or rater_kind is None:
+            return False
+        return rater_kind == "teacher" or target_group != rater_group
+
+    def _add(self, rater, target, score):
+        rated = self._by_rater.setdefault(rater, {})
+        is_new = target not in rated
+        rated[target] = score
+        self._by_target.setdefault(target, {})[rater] = score
+        if not is_new:
+            return
+        self._ratings += 1
+        if self._eligible(rater, target):
+            self._done[rater] += 1
+            self._coverage[self._bucket(rater)][0] += 1
+            missing = self._missing[rater]
+            missing.discard(target)
+            if not missing:
+                self._incomplete.discard(rater)
+
+    def rebuild(self, scores=None, users=None):
+        """Build from ``scores`` rows and ``users`` (the user directory), or read both from the database."""
+        users = db.get_user_directory() if users is None else users
+        with self._lock:
+            self._reset()
+            self.round_id = db.current_round_id()
+            for user in users:
+                kind = _kind(user['roles'])
+                group = user.get('group') or "Undefined"
+                self._users[user['username']] = (kind, group, user.get('realname'))
+                if kind == "student":
+                    self._students.setdefault(group, set()).add(user['username'])
+            self._student_total = sum(len(members) for members in self._students.values())
+            for rater, (kind, group, _) in self._users.items():
+                if kind is None:
+                    continue
+                expected = self._expected(rater)
+                self._coverage.setdefault(self._bucket(rater), [0, 0])[1] += expected
+                self._missing[rater] = {target for target_group, members in self._students.items()
+                                        if kind == "teacher" or target_group != group for target in members}
+                if expected:
+                    self._incomplete.add(rater)
+            pages = (db.iter_scores(columns=["rater", "target", "score"], round_id=self.round_id)
+                     if scores is None else [scores])
+            for page in pages:
+                for row in page:
+                    self._add(str(row['rater']), str(row['target']), row['score'])
+            self.ready = True
+
+    def apply(self, rows, previous):
+        with self._lock:
+            if not self.ready:
+                return
+            if previous is None:
+                self.ready = False
+                return
+            for row in rows:
+                self._add(row['rater'], row['target'], row['score'])
+
+    def invalidate(self, *args):
+        with self._lock:
+            self.ready = False
+
+    def ensure_fresh(self):
+        version = db.get_data_version()
+        with self._lock:
+            stale = version is not None and (version[1] != self._ratings or version[2] != len(self._users)
+                                             or version[-1] != self.round_id)
+            if not self.ready or stale:
+                self.rebuild()
+
+    def target_ratings(self, target):
+        """Ratings received by ``target`` as rows of rater, target and score, highest first."""
+        self.ensure_fresh()
+        with self._lock:
+            ratings = list(self._by_target.get(target, {}).items())
+        ratings.sort(key=lambda item: item[1], reverse=True)
+        return [{"rater": rater, "target": target, "score": score} for rater, score in ratings]
+
+    def rater_progress(self, rater):
+        self.ensure_fresh()
+        with self._lock:
+            return {"rater": rater, "done": self._done[rater], "expected": self._expected(rater)}
+
+    def incomplete_raters(self):
+        """Raters with eligible targets still unrated, with their group and progress."""
+        self.ensure_fresh()
+        with self._lock:
+            return sorted(
+                ({"rater": rater, "realname": self._users[rater][2], "group": self._bucket(rater),
+                  "done": self._done[rater], "expected": self._expected(rater)} for rater in self._incomplete),
+                key=lambda row: (row["group"], row["done"] - row["expected"], row["rater"]),
+            )
+
+    def missing_pairs(self, rater):
+        """Eligible targets ``rater`` has not rated yet."""
+        self.ensure_fresh()
+        with self._lock:
+            return sorted(self._missing.get(rater, ()))
+
+    def group_coverage(self):
+        """Per rater group (teachers as one bucket): rated pairs, expected pairs and incomplete raters."""
+        self.ensure_fresh()
+        with self._lock:
+            waiting = Counter(self._bucket(rater) for rater in self._incomplete)
+            return [{"group": group, "done": done, "expected": expected, "incomplete_raters": waiting[group]}
+                    for group, (done, expected) in sorted(self._coverage.items())]
+
+
+rating_index = RatingIndex()
+subscribe("scores", rating_index.apply)
+subscribe("users", rating_index.invalidate)
+
+
+@instrument
+def get_target_ratings(target):
+    return rating_index.target_ratings(target)
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Retry policy and circuit breaker for backend requests
+@author: 33952
+"""
+
+import random
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+RETRY_ATTEMPTS = 3
+RETRY_BASE_DELAY = 0.2   # 秒，第 n 次重试在 [0, base * 2^n] 内随机等待
+RETRY_MAX_DELAY = 2.0
+BREAKER_THRESHOLD = 5    # 连续失败多少次后断开
+BREAKER_RESET = 30.0     # 断开多少秒后放行一次探测请求
+
+# 可重试的 HTTP 状态码与 Postgres 错误码前缀（连接异常、超时、序列化冲突、资源不足）
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504, 520, 522, 524}
+TRANSIENT_PG_CODES = ("08", "40001", "40P01", "53", "57014", "57P")
+
+
+class CircuitOpenError(Exception):
+    """Raised without contacting the backend while the circuit breaker is open."""
+
+
+def is_transient(error):
+    """True for failures worth retrying: timeouts, dropped connections, 5xx/429, lock and overload errors."""
+    if isinstance(error, CircuitOpenError):
+        return True
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if isinstance(error, sqlite3.OperationalError):
+        return "locked" in str(error) or "busy" in str(error)
+    try:
+        import httpx
+        if isinstance(error, httpx.TransportError):
+            return True
+    except ImportError:
+        pass
+    code = getattr(error, "code", None)
+    if isinstance(code, int) or (isinstance(code, str) and code.isdigit() and len(code) == 3):
+        return int(code) in TRANSIENT_STATUS
+    return isinstance(code, str) and code.startswith(TRANSIENT_PG_CODES)
+
+
+class CircuitBreaker:
+    """Closed -> open after ``threshold`` consecutive failures -> half-open after ``reset`` seconds.
+
+    While half-open a single probe request is let through; its outcome closes
+    the breaker again or re-opens it for another ``reset`` seconds.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset=BREAKER_RESET):
+        self.threshold = threshold
+        self.reset = reset
+        self._lock = threading.Lock()
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = None
+        self.opened = 0
+        self._probing = False
+
+    def allow(self):
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset:
+                self.state = "half_open"
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state, self.failures, self._probing = "closed", 0, False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    self.opened += 1
+                self.state, self.opened_at = "open", time.monotonic()
+
+    def stats(self):
+        with self._lock:
+            retry_in = None
+            if self.state == "open":
+                retry_in = max(0.0, self.reset - (time.monotonic() - self.opened_at))
+            return {"state": self.state, "consecutive_failures": self.failures,
+                    "times_opened": self.opened, "retry_in_s": retry_in}
+
+
+class RetryPolicy:
+    """Run backend requests with jittered exponential backoff behind a circuit breaker.
+
+    Only idempotent requests (reads, upserts, updates, deletes) are retried;
+    inserts get a single attempt so a timed-out but applied insert is not
+    replayed into a duplicate-key error.
+    """
+
+    def __init__(self, attempts=RETRY_ATTEMPTS, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY,
+                 breaker=None):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.breaker = breaker or CircuitBreaker()
+        self._lock = threading.Lock()
+        self.counts = Counter()
+
+    def _count(self, name):
+        with self._lock:
+            self.counts[name] += 1
+
+    def call(self, request, idempotent=True):
+        attempts = self.attempts if idempotent else 1
+        for attempt in range(attempts):
+            if not self.breaker.allow():
+                self._count("rejected")
+                raise CircuitOpenError("后端暂时不可用（熔断中），请稍后重试")
+            self._count("requests")
+            try:
+                result = request()
+            except Exception as e:
+                if not is_transient(e):
+                    # 主键冲突等业务错误说明后端本身可用
+                    self.breaker.record_success()
+                    raise
+                self.breaker.record_failure()
+                self._count("failures")
+                if attempt + 1 >= attempts:
+                    raise
+                self._count("retries")
+                time.sleep(random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt)))
+            else:
+                self.breaker.record_success()
+                return result
+
+    def stats(self):
+        with self._lock:
+            counts = {name: self.counts[name] for name in ("requests", "retries", "failures", "rejected")}
+        return {**counts, "breaker": self.breaker.stats()}
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned results snapshots shared across sessions
+@author: 33952
+"""
+
+import threading
+import time
+
+import plotly.io as pio
+import streamlit as st
+
+import database as db
+from metrics import instrument
+from rollups import get_trend
+from scoring import aggregator, calculate_scores
+from visualization import plot_group_comparison, plot_individual_comparison, plot_scoring_trends, plot_scoring_details
+
+
+class ResultsSnapshot:
+    """Final scores and figure JSON computed once for one data version."""
+
+    def __init__(self, version, scores, figures):
+        self.version = version
+        self.scores = scores
+        self.figures = figures
+        self.built_at = time.time()
+        self._details = {}
+        self._lock = threading.Lock()
+
+    def figure(self, name):
+        return pio.from_json(self.figures[name])
+
+    def details_figure(self, target):
+        # 评分详情按被评分者懒构建，同一版本内只构建一次
+        with self._lock:
+            cached = self._details.get(target)
+        if cached is None:
+            cached = plot_scoring_details(target).to_json()
+            with self._lock:
+                self._details[target] = cached
+        return pio.from_json(cached)
+
+
+def build_snapshot(version):
+    # 先让增量聚合追上要构建的版本（包括其他进程的写入），否则新版本会沿用旧的分数
+    aggregator.ensure_fresh(version)
+    scores = calculate_scores()
+    figures = {
+        "group": plot_group_comparison(scores).to_json(),
+        "individual": plot_individual_comparison(scores).to_json(),
+        "trends": plot_scoring_trends(trend=get_trend("day")).to_json(),
+    }
+    return ResultsSnapshot(version, scores, figures)
+
+
+class ResultsStore:
+    """Process-wide store keeping the current snapshot and the one before it.
+
+    The first session to see a new data version builds its snapshot; sessions
+    arriving meanwhile are served the latest finished snapshot instead of
+    waiting or building the same version again. When a build fails, the latest
+    snapshot still held is served as stale.
+    """
+
+    def __init__(self, build=build_snapshot):
+        self._build = build
+        self._cond = threading.Condition()
+        self.current = None
+        self.previous = None
+        self._building = None
+
+    def get(self):
+        """Return (snapshot, stale); ``stale`` is True while a newer version is being built."""
+        version = db.get_data_version()
+        with self._cond:
+            while True:
+                if self.current is not None and self.current.version == version:
+                    return self.current, False
+                if self._building is None:
+                    self._building = version
+                    break
+                if self.current is not None:
+                    return self.current, True
+                # 尚无可用快照时等待正在进行的构建
+                self._cond.wait()
+        try:
+            snapshot = self._build(version)
+        except Exception as e:
+            with self._cond:
+                self._building = None
+                self._cond.notify_all()
+                fallback = self.current or self.previous
+            if fallback is None:
+                raise
+            st.warning(f"结果更新失败，显示上一版本: {e}")
+            return fallback, True
+        with self._cond:
+            if self.current is None or self.current.version != version:
+                self.previous, self.current = self.current, snapshot
+            self._building = None
+            self._cond.notify_all()
+        return snapshot, False
+
+    def clear(self):
+        with self._cond:
+            self.current = self.previous = None
+
+    def stats(self):
+        with self._cond:
+            return {
+                "current": self.current.version if self.current else None,
+                "previous": self.previous.version if self.previous else None,
+                "building": self._building,
+            }
+
+
+results_store = ResultsStore()
+
+
+@instrument
+def get_results():
+    return results_store.get()
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental time-bucketed score rollups for trend analysis
+@author: 33952
+"""
+
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import database as db
+from database import subscribe
+from metrics import instrument
+
+GRANULARITIES = ("hour", "day", "week")
+BASE_GRANULARITY = "hour"
+# 晚提交的写入可能带有早于水位线的时间戳，增量扫描向前多读这一段并按行去重
+WATERMARK_LAG = pd.Timedelta(seconds=5)
+
+def floor_buckets(ts, granularity):
+    """Floor naive UTC datetimes to bucket starts; weeks start on Monday."""
+    if granularity == "hour":
+        return ts.dt.floor("h")
+    day = ts.dt.floor("D")
+    if granularity == "day":
+        return day
+    if granularity == "week":
+        return day - pd.to_timedelta(day.dt.weekday, unit="D")
+    raise ValueError(f"未知的时间粒度: {granularity}")
+
+def bucket_starts(timestamps, granularity):
+    """UTC bucket start for each ISO timestamp string."""
+    return floor_buckets(pd.to_datetime(timestamps, format="ISO8601", utc=True).dt.tz_localize(None), granularity)
+
+class TrendRollup:
+    """Per (bucket, target) score sums and counts at ``base`` granularity.
+
+    ``refresh`` folds in only the rows newer than the last processed timestamp.
+    Overwritten scores keep their original timestamp, so they never show up in
+    that scan; the "scores" listener moves their sums instead. Coarser
+    granularities are summed from the base buckets without touching raw scores.
+    Only the current round is rolled up; a round change triggers a rebuild.
+    """
+
+    def __init__(self, base=BASE_GRANULARITY):
+        if base not in GRANULARITIES:
+            raise ValueError(f"未知的时间粒度: {base}")
+        self.base = base
+        self._lock = threading.RLock()
+        self.ready = False
+        self._sums = pd.DataFrame({"score_sum": pd.Series(dtype="float64"), "score_count": pd.Series(dtype="float64")},
+                                  index=pd.MultiIndex.from_arrays([[], []], names=["bucket", "target"]))
+        self.watermark = None
+        self._recent = set()
+        self.round_id = None
+
+    def _fold(self, frame):
+        # frame: bucket, target, score_sum, score_count（增量，可为负）
+        delta = frame.groupby(["bucket", "target"])[["score_sum", "score_count"]].sum()
+        self._sums = self._sums.add(delta, fill_value=0)
+        self._sums = self._sums[self._sums["score_count"] > 0]
+
+    def _ingest(self, scores):
+        if scores.empty:
+            return
+        ts = pd.to_datetime(scores["timestamp"], format="ISO8601", utc=True)
+        raters, targets = scores["rater"].astype(str).to_numpy(), scores["target"].astype(str).to_numpy()
+        # 只有落在上次回看窗口内（含下界）的行可能已计入，逐行比对仅限这一部分；
+        # 下界上的行是否被 since 排除取决于后端的时间戳格式，这里不依赖它
+        fresh = np.ones(len(scores), dtype=bool)
+        if self._recent:
+            for i in np.flatnonzero((ts >= self.watermark - WATERMARK_LAG).to_numpy()):
+                fresh[i] = (raters[i], targets[i], ts.iloc[i]) not in self._recent
+        if not fresh.any():
+            return
+        scores, ts, raters, targets = scores[fresh], ts[fresh], raters[fresh], targets[fresh]
+        self._fold(pd.DataFrame({
+            "bucket": floor_buckets(ts.dt.tz_localize(None), self.base).to_numpy(),
+            "target": targets,
+            "score_sum": scores["score"].astype("float64").to_numpy(),
+            "score_count": 1,
+        }))
+        latest = ts.max()
+        self.watermark = latest if self.watermark is None else max(self.watermark, latest)
+        floor = self.watermark - WATERMARK_LAG
+        self._recent = {key for key in self._recent if key[2] >= floor}
+        self._recent.update((raters[i], targets[i], ts.iloc[i]) for i in np.flatnonzero((ts >= floor).to_numpy()))
+
+    def rebuild(self):
+        with self._lock:
+            self._sums = self._sums.iloc[0:0]
+            self.watermark = None
+            self._recent = set()
+            self.round_id = db.current_round_id()
+            pages = db.iter_scores_since(None, columns=["rater", "target", "score", "timestamp"], round_id=self.round_id)
+            self._ingest(db.frame_from_pages(pages))
+            self.ready = True
+
+    def refresh(self):
+        """Fold in rows newer than the watermark (minus ``WATERMARK_LAG``)."""
+        with self._lock:
+            if not self.ready or self.round_id != db.current_round_id():
+                return self.rebuild()
+            since = None
+            if self.watermark is not None:
+                since = (self.watermark - WATERMARK_LAG).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+            pages = db.iter_scores_since(since, columns=["rater", "target", "score", "timestamp"], round_id=self.round_id)
+            self._ingest(db.frame_from_pages(pages))
+
+    def apply(self, rows, previous):
+        with self._lock:
+            if not self.ready:
+                return
+            if previous is None:
+                self.ready = False
+                return
+            floor = self.watermark - WATERMARK_LAG if self.watermark is not None else None
+            moved = []
+            for row in rows:
+                old = previous.get((row['rater'], row['target']))
+                if old is None:
+                    continue  # 新行由下次 refresh 扫描计入
+                ts = pd.Timestamp(old['timestamp'])
+                ts = ts.tz_localize("UTC") if ts.tzinfo is None else ts.tz_convert("UTC")
+                counted = (str(row['rater']), str(row['target']), ts) in self._recent or (floor is not None and ts <= floor)
+                if counted:
+                    moved.append((old['timestamp'], row['target'], row['score'] - old['score']))
+            if moved:
+                timestamps, targets, deltas = zip(*moved)
+                self._fold(pd.DataFrame({
+                    "bucket": bucket_starts(pd.Series(timestamps), self.base).to_numpy(),
+                    "target": [str(t) for t in targets], "score_sum": deltas, "score_count": 0,
+                }))
+
+    def trend(self, granularity="day"):
+        """Mean score per (date, target) at ``granularity``; ``date`` is the bucket start."""
+        if GRANULARITIES.index(granularity) < GRANULARITIES.index(self.base):
+            raise ValueError(f"粒度 {granularity} 细于基础粒度 {self.base}")
+        with self._lock:
+            self.refresh()
+            sums = self._sums.reset_index()
+        if sums.empty:
+            return pd.DataFrame(columns=["date", "target", "score"])
+        if granularity != self.base:
+            sums["bucket"] = floor_buckets(sums["bucket"], granularity)
+            sums = sums.groupby(["bucket", "target"], as_index=False)[["score_sum", "score_count"]].sum()
+        sums["score"] = sums["score_sum"].astype("float64") / sums["score_count"].astype("float64")
+        trend = sums.rename(columns={"bucket": "date"}).sort_values(["date", "target"])
+        return trend[["date", "target", "score"]].reset_index(drop=True)
+
+rollup = TrendRollup()
+subscribe("scores", rollup.apply)
+
+@instrument
+def get_trend(granularity="day"):
+    try:
+        return rollup.trend(granularity)
+    except Exception as e:
+        st.error(f"Error computing {granularity} trend: {e}")
+        return pd.DataFrame(columns=["date", "target", "score"])
@@ -4,41 +4,208 @@ Score calculation logic
 @author: 33952
 """
 
+import threading
+import numpy as np
 import pandas as pd
-from database import get_all_users
+from database import (AGGREGATE_COLUMNS, current_round_id, finish_round, get_all_scores, get_current_round,
+                      get_data_version, get_rating_aggregates, get_round_results, get_rounds, get_user_directory, subscribe)
+from metrics import instrument
 
-def calculate_scores(scores_data):
+# 教师评分为 15 分制，折算到学生的 10 分制
+TEACHER_WEIGHT = 10 / 15
+
+def user_roles(users):
+    """Return a username-indexed Series with one row per (user, role)."""
+    # roles 可能是列表（get_user_directory）或逗号分隔的字符串（数据库原始值）
+    roles = users.set_index('username')['roles'].explode().astype(str).str.split(',').explode()
+    return roles.str.strip()
+
+def rating_aggregates(scores, users):
+    """Per-target sum and count of scores, split by the rater's role in the users table."""
+    scores = pd.DataFrame(scores)
+    if scores.empty:
+        return pd.DataFrame(columns=AGGREGATE_COLUMNS, index=pd.Index([], name='target'))
+    roles = user_roles(pd.DataFrame(users))
+    target_codes, targets = pd.factorize(scores['target'])
+    values = scores['score'].to_numpy(dtype=float)
+    columns = {}
+    for role in ('teacher', 'student'):
+        mask = scores['rater'].isin(roles.index[roles == role.capitalize()]).to_numpy()
+        columns[f'{role}_sum'] = np.bincount(target_codes[mask], weights=values[mask], minlength=len(targets))
+        columns[f'{role}_count'] = np.bincount(target_codes[mask], minlength=len(targets))
+    return pd.DataFrame(columns, index=pd.Index(targets, name='target'))
+
+def personal_scores(aggregates):
+    """Personal score per target: mean of the weighted teacher and student means that exist."""
+    teacher = aggregates['teacher_sum'] / aggregates['teacher_count'].replace(0, np.nan) * TEACHER_WEIGHT
+    student = aggregates['student_sum'] / aggregates['student_count'].replace(0, np.nan)
+    return pd.concat([teacher, student], axis=1).mean(axis=1).dropna()
+
+def final_scores(users, personal):
+    """Final score: half personal score, half the mean personal score of the user's group."""
+    users = pd.DataFrame(users)
+    personal = users['username'].map(personal).fillna(0).to_numpy(dtype=float)
+    group_codes, _ = pd.factorize(users['group'], use_na_sentinel=False)
+    group_sum = np.bincount(group_codes, weights=personal)
+    group_avg = group_sum / np.bincount(group_codes)
+    return pd.DataFrame({
+        'username': users['username'], 'realname': users['realname'],
+        'group': users['group'], 'final_score': personal * 0.5 + group_avg[group_codes] * 0.5
+    })
+
+def _personal_from_sums(teacher_sum, teacher_count, student_sum, student_count):
+    parts = []
+    if teacher_count:
+        parts.append(teacher_sum / teacher_count * TEACHER_WEIGHT)
+    if student_count:
+        parts.append(student_sum / student_count)
+    return sum(parts) / len(parts) if parts else 0.0
+
+class ScoreAggregator:
+    """Running per-target sums and counts by rater role, plus per-group sums of personal scores.
+
+    ``apply`` folds in one written chunk of scores, retracting the values it
+    overwrote. Unknown previous values and new users mark the aggregator stale.
+    Writes from other processes never reach ``apply``, so every read also
+    compares the score count, user count and round of the data version with
+    those the aggregator was built from, and rebuilds when they differ.
+    Overwrites made elsewhere change none of the three and are picked up only
+    by the next rebuild.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.ready = False
+        self.round_id = None
+        self._built_from = None  # (评分行数, 用户数, 轮次)，与 get_data_version 对应的部分比较
+
+    def rebuild(self, scores=None, users=None):
+        version = get_data_version() if scores is None else None
+        users = pd.DataFrame(get_user_directory() if users is None else users)
+        round_id = version[-1] if version else current_round_id()
+        aggregates = get_rating_aggregates(round_id) if scores is None else rating_aggregates(scores, users)
+        roles = user_roles(users)
+        with self._lock:
+            self.round_id = round_id
+            self._built_from = ((version[1], version[2]) if version else (len(scores), len(users))) + (round_id,)
+            self._teachers = set(roles.index[roles == 'Teacher'])
+            self._students = set(roles.index[roles == 'Student'])
+            self._sums = {target: list(row) for target, row in zip(aggregates.index, aggregates.to_numpy(dtype=float))}
+            self._users = users[['username', 'realname', 'group']].reset_index(drop=True)
+            self._positions = dict(zip(self._users['username'], range(len(self._users))))
+            self._personal = np.array(self._users['username'].map(personal_scores(aggregates)).fillna(0), dtype=float)
+            self._group_codes, _ = pd.factorize(self._users['group'], use_na_sentinel=False)
+            self._group_sum = np.bincount(self._group_codes, weights=self._personal)
+            self._group_size = np.bincount(self._group_codes)
+            self.ready = True
+
+    def invalidate(self, *args):
+        with self._lock:
+            self.ready = False
+
+    def apply(self, rows, previous):
+        with self._lock:
+            if not self.ready:
+                return
+            if previous is None:
+                self.ready = False
+                return
+            changed = set()
+            for row in rows:
+                rater, target = row['rater'], row['target']
+                roles = [offset for offset, members in ((0, self._teachers), (2, self._students)) if rater in members]
+                old = previous.get((rater, target))
+                if old is None and self._built_from is not None:
+                    # 本进程新增的行计入行数，避免下次读取时误判为外部写入
+                    count, users, round_id = self._built_from
+                    self._built_from = (count + 1, users, round_id)
+                if not roles:
+                    continue
+                sums = self._sums.setdefault(target, [0.0, 0, 0.0, 0])
+                for offset in roles:
+                    sums[offset] += row['score'] - (old['score'] if old else 0)
+                    sums[offset + 1] += old is None
+                changed.add(target)
+            for target in changed:
+                position = self._positions.get(target)
+                if position is None:
+                    continue
+                personal = _personal_from_sums(*self._sums[target])
+                self._group_sum[self._group_codes[position]] += personal - self._personal[position]
+                self._personal[position] = personal
+
+    def ensure_fresh(self, version=None):
+        """Rebuild unless the aggregator matches ``version`` (the current data version by default)."""
+        version = get_data_version() if version is None else version
+        with self._lock:
+            if version is None:
+                stale = self.round_id != current_round_id()
+            else:
+                stale = self._built_from != (version[1], version[2], version[-1])
+            if not self.ready or stale:
+                self.rebuild()
+
+    def final_scores(self):
+        self.ensure_fresh()
+        with self._lock:
+            group_avg = self._group_sum / self._group_size
+            return self._users.assign(final_score=self._personal * 0.5 + group_avg[self._group_codes] * 0.5)
+
+    def verify(self, scores=None, users=None, tolerance=1e-9):
+        """Compare against the batch computation; rebuild from the same data on mismatch."""
+        users = pd.DataFrame(get_user_directory() if users is None else users)
+        scores = get_all_scores() if scores is None else scores
+        batch = calculate_scores(scores, users).set_index('username')['final_score']
+        incremental = self.final_scores().set_index('username')['final_score']
+        diff = (batch - incremental.reindex(batch.index)).abs().fillna(np.inf)
+        max_diff = float(diff.max()) if len(diff) else 0.0
+        ok = max_diff <= tolerance and len(incremental) == len(batch)
+        if not ok:
+            self.rebuild(scores, users)
+        return {'ok': ok, 'max_diff': max_diff}
+
+aggregator = ScoreAggregator()
+subscribe("scores", aggregator.apply)
+subscribe("users", aggregator.invalidate)
+
+def frozen_scores(round_id):
+    """Final scores stored when ``round_id`` was finished, in the calculate_scores layout."""
+    return pd.DataFrame(get_round_results(round_id), columns=['username', 'realname', 'group', 'final_score'])
+
+@instrument
+def calculate_scores(scores_data=None, users=None, round_id=None):
+    # 不传 scores_data 时：已结束的轮次读取冻结结果，进行中的当前轮次读取增量聚合结果
+    # users 可传入已加载的用户列表或 DataFrame
+    if scores_data is None:
+        rounds = {r['round_id']: r for r in get_rounds()}
+        round_id = current_round_id() if round_id is None else round_id
+        if rounds.get(round_id, {}).get('finished_at'):
+            return frozen_scores(round_id)
+        if round_id != current_round_id():
+            return calculate_scores(get_all_scores(round_id), users)
+        return aggregator.final_scores()
+    users = pd.DataFrame(get_user_directory() if users is None else users)
     df = pd.DataFrame(scores_data)
     if df.empty:
-        users = pd.DataFrame(get_all_users())
         return pd.DataFrame({
             'username': users['username'], 'realname': users['realname'],
             'group': users['group'], 'final_score': [0] * len(users)
         })
+    return final_scores(users, personal_scores(rating_aggregates(df, users)))
 
-    teacher_scores = df[df['rater'].str.contains('teacher', case=False)].groupby('target')['score'].mean() * (10/15)
-    student_scores = df[df['rater'].str.contains('student', case=False)].groupby('target')['score'].mean()
-
-    personal_scores = {}
-    for target in set(teacher_scores.index).union(student_scores.index):
-        t_score = teacher_scores.get(target, 0)
-        s_score = student_scores.get(target, 0)
-        personal_scores[target] = (t_score + s_score) / 2 if t_score and s_score else t_score or s_score
-
-    users = pd.DataFrame(get_all_users())
-    group_avg = {}
-    for group in users['group'].unique():
-        group_users = users[users['group'] == group]['username']
-        group_scores = [personal_scores.get(u, 0) for u in group_users]
-        group_avg[group] = sum(group_scores) / len(group_scores) if group_scores else 0
-
-    final_scores = {}
-    for user in users.itertuples():
-        personal = personal_scores.get(user.username, 0)
-        group_score = group_avg.get(user.group, 0)
-        final_scores[user.username] = (personal * 0.5 + group_score * 0.5)
-
-    return pd.DataFrame({
-        'username': users['username'], 'realname': users['realname'],
-        'group': users['group'], 'final_score': [final_scores.get(u, 0) for u in users['username']]
-    })
\ No newline at end of file
+@instrument
+def freeze_round():
+    """Finish the current round, storing its final scores and rating counts as the round's summary."""
+    current = get_current_round()
+    if current is None or current['finished_at']:
+        return False
+    round_id = current['round_id']
+    users = pd.DataFrame(get_user_directory())
+    aggregates = get_rating_aggregates(round_id)
+    final = final_scores(users, personal_scores(aggregates)) if len(users) else pd.DataFrame(
+        columns=['username', 'realname', 'group', 'final_score'])
+    counts = (aggregates['teacher_count'] + aggregates['student_count']).reindex(final['username']).fillna(0)
+    results = [{'username': row.username, 'realname': row.realname, 'group_name': row.group,
+                'final_score': float(row.final_score), 'rating_count': int(count)}
+               for row, count in zip(final.itertuples(index=False), counts.to_numpy())]
+    return finish_round(round_id, results)
@@ -0,0 +1,29 @@
+-- 服务端聚合视图：database.get_rating_aggregates / get_daily_means 通过 PostgREST 读取
+-- 在 Supabase SQL Editor 中执行一次即可（需先执行 rounds.sql）；缺少视图时应用会回退到客户端聚合
+-- 两个视图都按 round_id 分组，查询时按轮次过滤
+
+-- 每个被评分者按评分者角色（users.roles 中的 Teacher / Student）汇总的分数和与条数
+drop view if exists rating_aggregates;
+create view rating_aggregates as
+select s.round_id,
+       s.target,
+       coalesce(sum(s.score) filter (where 'Teacher' = any(string_to_array(u.roles, ','))), 0) as teacher_sum,
+       count(*) filter (where 'Teacher' = any(string_to_array(u.roles, ','))) as teacher_count,
+       coalesce(sum(s.score) filter (where 'Student' = any(string_to_array(u.roles, ','))), 0) as student_sum,
+       count(*) filter (where 'Student' = any(string_to_array(u.roles, ','))) as student_count
+from scores s
+join users u on u.username = s.rater
+group by s.round_id, s.target;
+
+-- 每天每个被评分者的分数和与条数（按 UTC 日期，与客户端 pd.to_datetime(...).dt.date 一致）
+drop view if exists daily_target_scores;
+create view daily_target_scores as
+select s.round_id,
+       to_char(s.timestamp at time zone 'UTC', 'YYYY-MM-DD') as date,
+       s.target,
+       sum(s.score) as score_sum,
+       count(*) as score_count
+from scores s
+group by 1, 2, 3;
+
+-- 趋势汇总（rollups.py）按 (round_id, timestamp) 增量扫描新行，索引见 rounds.sql
@@ -0,0 +1,29 @@
+-- 评分轮次：database.get_rounds / start_round / finish_round 通过 PostgREST 读写
+-- 在 Supabase SQL Editor 中执行一次（先于 aggregates.sql）；已有评分归入初始轮次 'initial'
+
+create table if not exists rounds (
+    round_id text primary key,
+    name text not null,
+    started_at timestamptz not null default now(),
+    finished_at timestamptz
+);
+insert into rounds (round_id, name) values ('initial', '初始轮次') on conflict do nothing;
+
+-- 评分按轮次分区：主键与索引都以 round_id 开头，当前轮次的查询不会扫描往届数据
+alter table scores add column if not exists round_id text not null default 'initial' references rounds (round_id);
+alter table scores drop constraint if exists scores_pkey;
+alter table scores add primary key (round_id, rater, target);
+drop index if exists scores_timestamp_idx;
+create index if not exists scores_round_target_idx on scores (round_id, target);
+create index if not exists scores_round_timestamp_idx on scores (round_id, timestamp);
+
+-- 结束轮次时冻结的最终得分，往届结果只读这张表
+create table if not exists round_results (
+    round_id text not null references rounds (round_id),
+    username text not null,
+    realname text,
+    group_name text,
+    final_score double precision not null,
+    rating_count integer not null default 0,
+    primary key (round_id, username)
+);
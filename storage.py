@@ -0,0 +1,450 @@
+# -*- coding: utf-8 -*-
+"""
+Storage backends for users, groups and scores
+@author: 33952
+"""
+
+import sqlite3
+import threading
+
+from resilience import RetryPolicy
+
+
+class DuplicateKeyError(Exception):
+    """Raised when an insert hits an existing primary key."""
+    code = '23505'  # 与 Postgres 唯一约束冲突码一致，调用方统一按 code 判断
+
+
+class StorageBackend:
+    """Interface shared by every backend.
+
+    Rows use the database column names (``group_name``, encrypted ``password``);
+    decryption, caching and listeners stay in the database module. Every score
+    read is scoped to one ``round_id``; resolving the current round is left to
+    the database module.
+    """
+
+    def insert_user(self, row):
+        raise NotImplementedError
+
+    def insert_users(self, rows):
+        raise NotImplementedError
+
+    def get_user_row(self, username):
+        raise NotImplementedError
+
+    def update_user(self, username, fields):
+        raise NotImplementedError
+
+    def user_pages(self, columns, page_size):
+        raise NotImplementedError
+
+    def students_excluding_group(self, group, columns):
+        raise NotImplementedError
+
+    def insert_group(self, group_name):
+        raise NotImplementedError
+
+    def group_names(self):
+        raise NotImplementedError
+
+    def delete_group(self, group_name):
+        raise NotImplementedError
+
+    def upsert_scores(self, rows):
+        """Upsert rows of round_id, rater, target and score."""
+        raise NotImplementedError
+
+    def score_pages(self, round_id, columns, page_size):
+        raise NotImplementedError
+
+    def score_pages_since(self, round_id, since, columns, page_size):
+        """Scores with timestamp after ``since`` (all when None), oldest first."""
+        raise NotImplementedError
+
+    def scores_for_raters(self, round_id, raters, columns):
+        raise NotImplementedError
+
+    def rating_aggregate_pages(self, round_id, page_size):
+        """Per target: teacher_sum, teacher_count, student_sum, student_count, by the rater's roles."""
+        raise NotImplementedError
+
+    def daily_score_pages(self, round_id, page_size):
+        """Per (date, target): score_sum and score_count, date as YYYY-MM-DD."""
+        raise NotImplementedError
+
+    def data_version(self, round_id):
+        """Latest score timestamp and row count of the round's scores, and the row count of users."""
+        raise NotImplementedError
+
+    def round_rows(self):
+        """All rounds (round_id, name, started_at, finished_at), oldest first."""
+        raise NotImplementedError
+
+    def insert_round(self, row):
+        raise NotImplementedError
+
+    def update_round(self, round_id, fields):
+        raise NotImplementedError
+
+    def upsert_round_results(self, rows):
+        raise NotImplementedError
+
+    def round_result_rows(self, round_id, columns):
+        raise NotImplementedError
+
+    def resilience_stats(self):
+        """Retry and circuit-breaker counters; empty for backends without a retry policy."""
+        return {}
+
+
+class SupabaseBackend(StorageBackend):
+    """PostgREST backend; every request goes through ``policy`` (retries and circuit breaker)."""
+
+    def __init__(self, client, policy=None):
+        self.client = client
+        self.policy = policy or RetryPolicy()
+
+    def _execute(self, query, idempotent=True):
+        return self.policy.call(query.execute, idempotent)
+
+    def resilience_stats(self):
+        return self.policy.stats()
+
+    def _insert(self, table, rows):
+        try:
+            return self._execute(self.client.table(table).insert(rows), idempotent=False).data
+        except Exception as e:
+            if getattr(e, 'code', None) == '23505':
+                raise DuplicateKeyError(str(e)) from e
+            raise
+
+    def _pages(self, table, columns, order, page_size, where=None):
+        start = 0
+        while True:
+            query = self.client.table(table).select(", ".join(columns))
+            if where:
+                query = where(query)
+            for column in order:
+                query = query.order(column)
+            response = self._execute(query.range(start, start + page_size - 1))
+            if response.data:
+                yield response.data
+            if len(response.data) < page_size:
+                return
+            start += page_size
+
+    def insert_user(self, row):
+        return bool(self._insert("users", row))
+
+    def insert_users(self, rows):
+        return len(self._insert("users", rows))
+
+    def get_user_row(self, username):
+        response = self._execute(self.client.table("users").select("*").eq("username", username))
+        return response.data[0] if response.data else None
+
+    def update_user(self, username, fields):
+        return bool(self._execute(self.client.table("users").update(fields).eq("username", username)).data)
+
+    def user_pages(self, columns, page_size):
+        return self._pages("users", columns, ["username"], page_size)
+
+    def students_excluding_group(self, group, columns):
+        return self._execute(self.client.table("users").select(", ".join(columns)).neq("group_name", group).ilike("roles", "%Student%")).data
+
+    def insert_group(self, group_name):
+        return bool(self._insert("groups", {"group_name": group_name}))
+
+    def group_names(self):
+        return [row["group_name"] for row in self._execute(self.client.table("groups").select("group_name")).data]
+
+    def delete_group(self, group_name):
+        self._execute(self.client.table("groups").delete().eq("group_name", group_name))
+
+    def upsert_scores(self, rows):
+        # upsert 按主键 (round_id, rater, target) 覆盖，重放结果相同，可安全重试
+        self._execute(self.client.table("scores").upsert(rows))
+
+    def _scores(self, round_id, columns):
+        # 主键与各索引均以 round_id 开头，按轮次过滤只扫描该轮的行
+        return self.client.table("scores").select(", ".join(columns)).eq("round_id", round_id)
+
+    def score_pages(self, round_id, columns, page_size):
+        return self._pages("scores", columns, ["rater", "target"], page_size,
+                           lambda query: query.eq("round_id", round_id))
+
+    def score_pages_since(self, round_id, since, columns, page_size):
+        def where(query):
+            query = query.eq("round_id", round_id)
+            return query.gt("timestamp", since) if since else query
+        return self._pages("scores", columns, ["timestamp", "rater", "target"], page_size, where)
+
+    def scores_for_raters(self, round_id, raters, columns):
+        return self._execute(self._scores(round_id, columns).in_("rater", list(raters))).data
+
+    # 以下两个视图定义见 sql/aggregates.sql，按 round_id 分组
+    def rating_aggregate_pages(self, round_id, page_size):
+        columns = ["target", "teacher_sum", "teacher_count", "student_sum", "student_count"]
+        return self._pages("rating_aggregates", columns, ["target"], page_size,
+                           lambda query: query.eq("round_id", round_id))
+
+    def daily_score_pages(self, round_id, page_size):
+        return self._pages("daily_target_scores", ["date", "target", "score_sum", "score_count"], ["date", "target"],
+                           page_size, lambda query: query.eq("round_id", round_id))
+
+    def data_version(self, round_id):
+        scores = self._execute(self.client.table("scores").select("timestamp", count="exact")
+                               .eq("round_id", round_id).order("timestamp", desc=True).limit(1))
+        users = self._execute(self.client.table("users").select("username", count="exact").limit(1))
+        return {"scores_max_timestamp": scores.data[0]["timestamp"] if scores.data else None,
+                "scores_count": scores.count, "users_count": users.count}
+
+    # 评分轮次与冻结结果，表结构见 sql/rounds.sql
+    def round_rows(self):
+        return self._execute(self.client.table("rounds").select("round_id, name, started_at, finished_at")
+                             .order("started_at").order("round_id")).data
+
+    def insert_round(self, row):
+        return bool(self._insert("rounds", row))
+
+    def update_round(self, round_id, fields):
+        return bool(self._execute(self.client.table("rounds").update(fields).eq("round_id", round_id)).data)
+
+    def upsert_round_results(self, rows):
+        self._execute(self.client.table("round_results").upsert(rows))
+
+    def round_result_rows(self, round_id, columns):
+        return [row for page in self._pages("round_results", columns, ["username"], 1000,
+                                            lambda query: query.eq("round_id", round_id)) for row in page]
+
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    realname TEXT NOT NULL,
+    roles TEXT NOT NULL,
+    group_name TEXT,
+    password TEXT NOT NULL,
+    modified INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_users_group ON users (group_name);
+CREATE TABLE IF NOT EXISTS groups (
+    group_name TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS rounds (
+    round_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    started_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    finished_at TEXT
+);
+INSERT OR IGNORE INTO rounds (round_id, name) VALUES ('initial', '初始轮次');
+CREATE TABLE IF NOT EXISTS scores (
+    round_id TEXT NOT NULL DEFAULT 'initial' REFERENCES rounds (round_id),
+    rater TEXT NOT NULL,
+    target TEXT NOT NULL,
+    score INTEGER NOT NULL,
+    timestamp TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    PRIMARY KEY (round_id, rater, target)
+);
+CREATE INDEX IF NOT EXISTS idx_scores_round_target ON scores (round_id, target);
+CREATE INDEX IF NOT EXISTS idx_scores_round_timestamp ON scores (round_id, timestamp);
+CREATE TABLE IF NOT EXISTS round_results (
+    round_id TEXT NOT NULL REFERENCES rounds (round_id),
+    username TEXT NOT NULL,
+    realname TEXT,
+    group_name TEXT,
+    final_score REAL NOT NULL,
+    rating_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (round_id, username)
+);
+"""
+
+# 旧版 scores 表没有 round_id：改名后按新结构重建，原有评分归入初始轮次
+SQLITE_MIGRATE_SCORES = """
+INSERT INTO scores (round_id, rater, target, score, timestamp)
+    SELECT 'initial', rater, target, score, timestamp FROM scores_v1;
+DROP TABLE scores_v1;
+"""
+
+# 各表主键，用于键集分页（比 OFFSET 分页在大表上更快）；scores 在单个轮次内分页
+SQLITE_KEYS = {"users": ("username",), "groups": ("group_name",), "scores": ("rater", "target"),
+               "round_results": ("username",)}
+
+
+class SQLiteBackend(StorageBackend):
+    """Local single-file store; one shared connection guarded by a lock."""
+
+    def __init__(self, path=":memory:"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            if path != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            columns = [row["name"] for row in self._conn.execute("PRAGMA table_info(scores)")]
+            migrate = bool(columns) and "round_id" not in columns
+            if migrate:
+                self._conn.execute("ALTER TABLE scores RENAME TO scores_v1")
+            self._conn.executescript(SQLITE_SCHEMA)
+            if migrate:
+                self._conn.executescript(SQLITE_MIGRATE_SCORES)
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def _write(self, sql, params=(), many=False):
+        with self._lock:
+            try:
+                with self._conn:
+                    cursor = self._conn.executemany(sql, params) if many else self._conn.execute(sql, params)
+                    return cursor.rowcount
+            except sqlite3.IntegrityError as e:
+                raise DuplicateKeyError(str(e)) from e
+
+    def _pages(self, table, columns, page_size, round_id=None):
+        keys = SQLITE_KEYS[table]
+        selected = list(dict.fromkeys(list(keys) + list(columns)))
+        order = ", ".join(keys)
+        last = None
+        while True:
+            conditions = ["round_id = ?"] if round_id is not None else []
+            if last:
+                conditions.append(f"({order}) > ({', '.join('?' * len(keys))})")
+            where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+            params = ([round_id] if round_id is not None else []) + list(last or ())
+            rows = self._query(
+                f"SELECT {', '.join(selected)} FROM {table} {where} ORDER BY {order} LIMIT ?",
+                (*params, page_size)
+            )
+            if rows:
+                last = tuple(rows[-1][k] for k in keys)
+                yield [{c: row[c] for c in columns} for row in rows]
+            if len(rows) < page_size:
+                return
+
+    def insert_user(self, row):
+        columns = list(row)
+        sql = f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        return self._write(sql, [row[c] for c in columns]) == 1
+
+    def insert_users(self, rows):
+        columns = list(rows[0]) if rows else []
+        sql = f"INSERT INTO users ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        return self._write(sql, [[row[c] for c in columns] for row in rows], many=True) if rows else 0
+
+    def get_user_row(self, username):
+        rows = self._query("SELECT * FROM users WHERE username = ?", (username,))
+        return rows[0] if rows else None
+
+    def update_user(self, username, fields):
+        assignments = ", ".join(f"{c} = ?" for c in fields)
+        return self._write(f"UPDATE users SET {assignments} WHERE username = ?", [*fields.values(), username]) > 0
+
+    def user_pages(self, columns, page_size):
+        return self._pages("users", columns, page_size)
+
+    def students_excluding_group(self, group, columns):
+        return self._query(
+            f"SELECT {', '.join(columns)} FROM users WHERE group_name != ? AND roles LIKE '%Student%'", (group,)
+        )
+
+    def insert_group(self, group_name):
+        return self._write("INSERT INTO groups (group_name) VALUES (?)", (group_name,)) == 1
+
+    def group_names(self):
+        return [row["group_name"] for row in self._query("SELECT group_name FROM groups ORDER BY group_name")]
+
+    def delete_group(self, group_name):
+        self._write("DELETE FROM groups WHERE group_name = ?", (group_name,))
+
+    def upsert_scores(self, rows):
+        # 与 PostgREST upsert 一致：冲突时只更新分数，保留首次评分时间
+        self._write(
+            "INSERT INTO scores (round_id, rater, target, score, timestamp) "
+            "VALUES (?, ?, ?, ?, COALESCE(?, strftime('%Y-%m-%dT%H:%M:%fZ', 'now'))) "
+            "ON CONFLICT (round_id, rater, target) DO UPDATE SET score = excluded.score",
+            [(row["round_id"], row["rater"], row["target"], row["score"], row.get("timestamp")) for row in rows],
+            many=True
+        )
+
+    def score_pages(self, round_id, columns, page_size):
+        return self._pages("scores", columns, page_size, round_id)
+
+    def score_pages_since(self, round_id, since, columns, page_size):
+        selected = list(dict.fromkeys(["timestamp", "rater", "target"] + list(columns)))
+        # 首页与 Supabase 的 gt 一致，严格晚于 since；之后按 (timestamp, rater, target) 键集翻页
+        where, last = ("AND timestamp > ?", (since,)) if since else ("", ())
+        while True:
+            rows = self._query(
+                f"SELECT {', '.join(selected)} FROM scores WHERE round_id = ? {where}"
+                f" ORDER BY timestamp, rater, target LIMIT ?",
+                (round_id, *last, page_size)
+            )
+            if rows:
+                where = "AND (timestamp, rater, target) > (?, ?, ?)"
+                last = (rows[-1]["timestamp"], rows[-1]["rater"], rows[-1]["target"])
+                yield [{c: row[c] for c in columns} for row in rows]
+            if len(rows) < page_size:
+                return
+
+    def scores_for_raters(self, round_id, raters, columns):
+        raters = list(raters)
+        return self._query(
+            f"SELECT {', '.join(columns)} FROM scores"
+            f" WHERE round_id = ? AND rater IN ({', '.join('?' * len(raters))})", [round_id, *raters]
+        )
+
+    def rating_aggregate_pages(self, round_id, page_size):
+        has_role = "instr(',' || u.roles || ',', ',{}') > 0"
+        teacher, student = has_role.format("Teacher,"), has_role.format("Student,")
+        rows = self._query(
+            f"SELECT s.target,"
+            f" SUM(CASE WHEN {teacher} THEN s.score ELSE 0 END) AS teacher_sum,"
+            f" SUM(CASE WHEN {teacher} THEN 1 ELSE 0 END) AS teacher_count,"
+            f" SUM(CASE WHEN {student} THEN s.score ELSE 0 END) AS student_sum,"
+            f" SUM(CASE WHEN {student} THEN 1 ELSE 0 END) AS student_count"
+            f" FROM scores s JOIN users u ON u.username = s.rater WHERE s.round_id = ?"
+            f" GROUP BY s.target ORDER BY s.target", (round_id,)
+        )
+        for start in range(0, len(rows), page_size):
+            yield rows[start:start + page_size]
+
+    def daily_score_pages(self, round_id, page_size):
+        rows = self._query(
+            "SELECT substr(timestamp, 1, 10) AS date, target, SUM(score) AS score_sum, COUNT(*) AS score_count"
+            " FROM scores WHERE round_id = ? GROUP BY 1, 2 ORDER BY 1, 2", (round_id,)
+        )
+        for start in range(0, len(rows), page_size):
+            yield rows[start:start + page_size]
+
+    def data_version(self, round_id):
+        scores = self._query("SELECT MAX(timestamp) AS max_timestamp, COUNT(*) AS count FROM scores"
+                             " WHERE round_id = ?", (round_id,))[0]
+        users = self._query("SELECT COUNT(*) AS count FROM users")[0]
+        return {"scores_max_timestamp": scores["max_timestamp"], "scores_count": scores["count"],
+                "users_count": users["count"]}
+
+    def round_rows(self):
+        return self._query("SELECT round_id, name, started_at, finished_at FROM rounds ORDER BY started_at, round_id")
+
+    def insert_round(self, row):
+        columns = list(row)
+        sql = f"INSERT INTO rounds ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+        return self._write(sql, [row[c] for c in columns]) == 1
+
+    def update_round(self, round_id, fields):
+        assignments = ", ".join(f"{c} = ?" for c in fields)
+        return self._write(f"UPDATE rounds SET {assignments} WHERE round_id = ?", [*fields.values(), round_id]) > 0
+
+    def upsert_round_results(self, rows):
+        columns = ["round_id", "username", "realname", "group_name", "final_score", "rating_count"]
+        self._write(
+            f"INSERT OR REPLACE INTO round_results ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+            [[row[c] for c in columns] for row in rows], many=True
+        )
+
+    def round_result_rows(self, round_id, columns):
+        return [row for page in self._pages("round_results", columns, 1000, round_id) for row in page]
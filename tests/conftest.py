@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+Test setup: in-memory SQLite backend and a throwaway encryption key
+@author: 33952
+"""
+
+import os
+
+os.environ.setdefault("SCORING_BACKEND", "sqlite")
+os.environ.setdefault("SCORING_SQLITE_PATH", ":memory:")
+if not os.environ.get("SCORING_ENCRYPTION_KEY"):
+    from cryptography.fernet import Fernet
+    os.environ["SCORING_ENCRYPTION_KEY"] = Fernet.generate_key().decode()
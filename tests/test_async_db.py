@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+Per-request timeouts of the concurrent loader
+@author: 33952
+"""
+
+import time
+
+import async_db
+
+
+def test_load_bundle_returns_at_the_timeout_not_after_the_slow_read(monkeypatch):
+    monkeypatch.setattr(async_db, "adb", async_db.AsyncDatabase(timeout=0.5))
+    started = time.perf_counter()
+    results = async_db.load_bundle({"slow": (time.sleep, 3), "fast": (lambda: 2)}, defaults={"slow": None})
+    elapsed = time.perf_counter() - started
+    assert results == {"slow": None, "fast": 2}
+    assert elapsed < 1.5
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Export -> import round trip on the in-memory SQLite backend
+@author: 33952
+"""
+
+import io
+
+import pandas as pd
+
+import database as db
+import export
+from importer import _text, import_workbook
+from storage import SQLiteBackend
+
+
+def test_text_keeps_text_cells_and_drops_float_suffix():
+    values = pd.Series(["0012", "1e3", " abc ", 1234.0, 7, None], dtype=object)
+    assert _text(values).tolist()[:5] == ["0012", "1e3", "abc", "1234", "7"]
+    assert pd.isna(_text(values).iloc[5])
+
+
+def test_export_import_round_trip_keeps_numeric_looking_text():
+    db.set_backend(SQLiteBackend(":memory:"))
+    users = [
+        {"username": "007", "realname": "1e3", "roles": "Student", "group": "第一组", "password": "0012"},
+        {"username": "teacher1", "realname": "老师1", "roles": "Teacher", "group": "Undefined", "password": "1234"},
+    ]
+    assert all(result["ok"] for result in db.create_users_bulk(users))
+    db.save_scores_bulk([{"rater": "teacher1", "target": "007", "score": 12}])
+
+    out = io.BytesIO()
+    export.export(out, "xlsx", export.TABLE_COLUMNS)
+
+    db.set_backend(SQLiteBackend(":memory:"))
+    summaries = import_workbook(io.BytesIO(out.getvalue()))
+    assert [(s["sheet"], s["inserted"], s["failed"]) for s in summaries] == [("Users", 2, 0), ("Scores", 1, 0)]
+
+    user = db.get_user("007")
+    assert user["realname"] == "1e3"
+    assert user["password"] == "0012"
+    assert db.get_rater_scores("teacher1") == {"007": 12}
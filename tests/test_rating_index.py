@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Rating index progress queries against a brute-force scan
+@author: 33952
+"""
+
+import database as db
+from rating_index import RatingIndex
+from storage import SQLiteBackend
+
+
+def _user(username, roles, group):
+    return {"username": username, "realname": username, "roles": roles, "group_name": group,
+            "password": "x", "modified": 0}
+
+
+def test_missing_pairs_follow_saved_scores(monkeypatch):
+    backend = SQLiteBackend(":memory:")
+    backend.insert_users([_user("a1", "Student", "A"), _user("a2", "Student", "A"),
+                          _user("b1", "Student", "B"), _user("b2", "Student", "B"), _user("t1", "Teacher", "Undefined")])
+    db.set_backend(backend)
+    index = RatingIndex()
+    monkeypatch.setitem(db._listeners, "scores", [index.apply])  # 只让这个索引接收增量
+
+    assert index.missing_pairs("a1") == ["b1", "b2"]
+    assert index.missing_pairs("t1") == ["a1", "a2", "b1", "b2"]
+    db.save_scores("a1", {"b1": 5, "a2": 3})  # a2 与 a1 同组，不在合规对象内
+    assert index.missing_pairs("a1") == ["b2"]
+    db.save_scores("a1", {"b2": 6})
+    assert index.missing_pairs("a1") == []
+    assert "a1" not in {row["rater"] for row in index.incomplete_raters()}
+    assert index.rater_progress("a1") == {"rater": "a1", "done": 2, "expected": 2}
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+"""
+Incremental trend rollup against a full recomputation
+@author: 33952
+"""
+
+import pytest
+
+import database as db
+from rollups import TrendRollup
+from storage import SQLiteBackend
+
+
+@pytest.mark.parametrize("fraction", ["000000", "000"])
+def test_refresh_does_not_recount_rows_on_the_watermark_floor(fraction):
+    backend = SQLiteBackend(":memory:")
+    backend.insert_users([
+        {"username": name, "realname": name, "roles": "Student", "group_name": "第一组", "password": "x", "modified": 0}
+        for name in ("a", "b", "c")
+    ])
+    # 两行相差恰好 WATERMARK_LAG（5 秒），较早一行落在回看窗口的下界上
+    backend.upsert_scores([
+        {"round_id": db.DEFAULT_ROUND, "rater": "a", "target": "c", "score": 4,
+         "timestamp": f"2026-01-05T10:00:00.{fraction}Z"},
+        {"round_id": db.DEFAULT_ROUND, "rater": "b", "target": "c", "score": 8,
+         "timestamp": f"2026-01-05T10:00:05.{fraction}Z"},
+    ])
+    db.set_backend(backend)
+    rollup = TrendRollup()
+    for _ in range(3):
+        trend = rollup.trend("hour")
+        assert rollup._sums["score_count"].sum() == 2
+        assert trend["score"].tolist() == [6.0]
@@ -4,43 +4,137 @@ Data visualization with Plotly
 @author: 33952
 """
 
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
 import plotly.express as px
 import pandas as pd
-from database import get_all_scores
+from database import score_dates
+from rating_index import get_target_ratings
+from rollups import get_trend
+from metrics import instrument
 
 import plotly.io as pio
 pio.templates.default = "plotly_white"
 
-def plot_group_comparison(df):
+FIGURE_CACHE_SIZE = 64
+LARGE_DATA_TARGETS = 50        # 被评分者超过该数量时趋势图切换到大数据模式
+TREND_TOP_N = 10               # 大数据模式下单独绘制的被评分者数，其余合并为“其他”
+MAX_POINTS_PER_SERIES = 500    # 每条曲线发送到浏览器的最大点数
+OTHERS_LABEL = "其他"
+
+_figures = OrderedDict()
+_figures_lock = threading.Lock()
+_figure_stats = {"hits": 0, "misses": 0}
+
+def frame_hash(df):
+    """Content hash of a DataFrame: column names, dtypes and every value."""
+    digest = hashlib.sha1(repr((list(df.columns), [str(t) for t in df.dtypes])).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=False).values.tobytes())
+    return digest.hexdigest()
+
+def _cached_figure(name, df, build, *args):
+    # 同样的输入帧只构建一次图表；返回的图表在会话间共享，调用方不应修改
+    key = (name, frame_hash(df), args)
+    with _figures_lock:
+        fig = _figures.get(key)
+        if fig is not None:
+            _figures.move_to_end(key)
+            _figure_stats["hits"] += 1
+            return fig
+        _figure_stats["misses"] += 1
+    fig = build(df, *args)
+    with _figures_lock:
+        _figures[key] = fig
+        while len(_figures) > FIGURE_CACHE_SIZE:
+            _figures.popitem(last=False)
+    return fig
+
+def figure_cache_stats():
+    with _figures_lock:
+        return {"entries": len(_figures), **_figure_stats}
+
+def clear_figure_cache():
+    with _figures_lock:
+        _figures.clear()
+
+def downsample(df, x, series, max_points=MAX_POINTS_PER_SERIES):
+    """Thin each series to about ``max_points`` evenly spaced rows, always keeping its first and last."""
+    df = df.sort_values([series, x])
+    position = df.groupby(series, observed=True).cumcount().to_numpy()
+    size = df.groupby(series, observed=True)[x].transform('size').to_numpy()
+    step = np.maximum(size / max_points, 1)
+    keep = (np.floor(position / step) != np.floor((position - 1) / step)) | (position == size - 1)
+    return df[keep]
+
+def top_n_with_others(trend, n=TREND_TOP_N):
+    """Keep the ``n`` targets with the highest mean score and average the rest per date as one series."""
+    top = trend.groupby('target', observed=True)['score'].mean().nlargest(n).index
+    is_top = trend['target'].isin(top)
+    others = trend[~is_top].groupby('date', as_index=False)['score'].mean().assign(target=OTHERS_LABEL)
+    return pd.concat([trend[is_top].astype({'target': str}), others], ignore_index=True)
+
+def _build_group_comparison(df):
     fig = px.bar(df, x='group', y='final_score', color='group',
                  title="组间比较", labels={'group': '组别', 'final_score': '最终分数'})
     fig.update_layout(font=dict(family="SimHei", size=12))
     return fig
 
-def plot_individual_comparison(df):
+def _build_individual_comparison(df):
     fig = px.bar(df.sort_values('final_score'), x='realname', y='final_score', color='group',
                  title="个人比较", labels={'realname': '姓名', 'final_score': '最终分数'})
     fig.update_layout(font=dict(family="SimHei", size=12))
     return fig
 
-def plot_scoring_trends():
-    scores = pd.DataFrame(get_all_scores())
-    if not scores.empty:
-        scores['date'] = pd.to_datetime(scores['timestamp']).dt.date
-        trend = scores.groupby(['date', 'target'])['score'].mean().reset_index()
-        fig = px.line(trend, x='date', y='score', color='target',
-                      title="评分趋势", labels={'date': '日期', 'score': '分数', 'target': '被评分者'})
-        fig.update_layout(font=dict(family="SimHei", size=12))
-        return fig
+def _build_scoring_trends(trend, large):
+    title = "评分趋势"
+    if large:
+        # 大数据模式：只画前 N 名和“其他”，按曲线降采样，并用 WebGL 渲染
+        trend = downsample(top_n_with_others(trend), 'date', 'target')
+        title = f"评分趋势（前 {TREND_TOP_N} 名及其他）"
+    fig = px.line(trend, x='date', y='score', color='target', render_mode='webgl' if large else 'auto',
+                  title=title, labels={'date': '日期', 'score': '分数', 'target': '被评分者'})
+    fig.update_layout(font=dict(family="SimHei", size=12))
+    return fig
+
+def _build_scoring_details(filtered, target_user):
+    fig = px.bar(filtered, x='rater', y='score',
+                 title=f"{target_user} 的评分详情", labels={'rater': '评分者', 'score': '分数'})
+    fig.update_layout(font=dict(family="SimHei", size=12))
+    return fig
+
+@instrument
+def plot_group_comparison(df):
+    return _cached_figure("group_comparison", df, _build_group_comparison)
+
+@instrument
+def plot_individual_comparison(df):
+    return _cached_figure("individual_comparison", df, _build_individual_comparison)
+
+@instrument
+def plot_scoring_trends(scores=None, trend=None, large=None):
+    # trend 为按 (date, target) 预聚合的均值；传入原始评分 scores 时现场计算，都不传时读取增量汇总
+    # large 为 None 时按被评分者数量自动选择大数据模式
+    if trend is None and scores is None:
+        trend = get_trend("day")
+    elif trend is None:
+        if not scores.empty:
+            scores = scores.assign(date=score_dates(scores['timestamp']))
+            trend = scores.groupby(['date', 'target'], observed=True)['score'].mean().reset_index()
+    if trend is not None and not trend.empty:
+        if large is None:
+            large = trend['target'].nunique() > LARGE_DATA_TARGETS
+        return _cached_figure("scoring_trends", trend, _build_scoring_trends, bool(large))
     return px.scatter(title="暂无数据", labels={'x': '日期', 'y': '分数'})
 
-def plot_scoring_details(target_user):
-    scores = pd.DataFrame(get_all_scores())
+@instrument
+def plot_scoring_details(target_user, scores=None):
+    if scores is None:
+        # 评分索引只返回该被评分者收到的评分，已按分数降序
+        scores = pd.DataFrame(get_target_ratings(target_user))
     if not scores.empty:
         filtered = scores[scores['target'] == target_user].sort_values('score', ascending=False)
-        fig = px.bar(filtered, x='rater', y='score',
-                     title=f"{target_user} 的评分详情", labels={'rater': '评分者', 'score': '分数'})
-        fig.update_layout(font=dict(family="SimHei", size=12))
-        return fig
+        return _cached_figure("scoring_details", filtered, _build_scoring_details, target_user)
     return px.scatter(title="暂无数据", labels={'x': '评分者', 'y': '分数'})
-